@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""Measure the memory used per track of the library model.
+
+Usage: track_memory.py [number of tracks]
+"""
+
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from mcg.client import MCGAlbum
+from mcg.client import MCGTrack
+
+
+
+
+TRACKS_PER_ALBUM = 10
+ARTISTS = 500
+YEARS = 40
+
+
+def create_library(tracks):
+    """Create albums like Client does when loading the library."""
+    shared_values = {}
+    albums = {}
+    for album_number in range(tracks // TRACKS_PER_ALBUM):
+        artist = 'Artist {}'.format(album_number % ARTISTS)
+        album = MCGAlbum('Album {}'.format(album_number), 'localhost', '/music')
+        for track_number in range(TRACKS_PER_ALBUM):
+            track = MCGTrack(
+                artist,
+                'Title {}'.format(track_number),
+                'Artist {}/Album {}/{:02d}.flac'.format(album_number % ARTISTS, album_number, track_number),
+                shared_values
+            )
+            track.set_albumartists(artist, shared_values)
+            track.set_track(str(track_number + 1))
+            track.set_length('240')
+            track.set_date(str(1980 + album_number % YEARS))
+            track.set_last_modified('2020-01-01T00:00:00Z')
+            album.add_track(track)
+        albums[album.get_hash()] = album
+    return albums
+
+
+def main():
+    tracks = 100000
+    if len(sys.argv) > 1:
+        tracks = int(sys.argv[1])
+    tracks = tracks - tracks % TRACKS_PER_ALBUM
+
+    tracemalloc.start()
+    library = create_library(tracks)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("tracks: {}".format(tracks))
+    print("albums: {}".format(len(library)))
+    print("bytes: {}".format(size))
+    print("bytes per track: {:.0f}".format(size / tracks))
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,40 @@
 #!/usr/bin/env python3
 
 
+import atexit
+import concurrent.futures
 import configparser
+import functools
 import glob
+import inspect
+import itertools
+import json
 import logging
 import os
+import pickle
 import queue
 import re
 import socket
 import sys
 import threading
+import time
 import urllib.request
 
 from hashlib import md5
 
+from mcg.utils import HTTPConnectionPool
 from mcg.utils import SortOrder
+from mcg.utils import Utils
 
 
 
 
 class MPDException(Exception):
-    def __init__(self, error):
+    def __init__(self, error, response=None):
+        self._error = None
+        self._command_number = None
+        self._command_name = None
+        self._response = response or []
         super(MPDException, self).__init__(self._parse_error(error))
 
 
@@ -47,6 +61,13 @@ class MPDException(Exception):
         return self._command_name
 
 
+    def get_response(self):
+        """Return the lines read before the error occurred, e.g. the
+        responses of the successful commands of a command list.
+        """
+        return self._response
+
+
 class ConnectionException(MPDException):
     pass
 
@@ -100,10 +121,24 @@ class Client(Base):
     PROTOCOL_GREETING = 'OK MPD '
     # Protocol: completion mark
     PROTOCOL_COMPLETION = 'OK'
+    # Protocol: completion mark of a command within a command list
+    PROTOCOL_LIST_COMPLETION = 'list_OK'
     # Protocol: error mark
     PROTOCOL_ERROR = 'ACK '
     # Protocol: error: permission
     PROTOCOL_ERROR_PERMISSION = 4
+    # Protocol: error: unknown command
+    PROTOCOL_ERROR_UNKNOWN = 5
+    # Protocol: binary data mark
+    PROTOCOL_BINARY = 'binary'
+    # Commands to load album art with (in order of preference)
+    ALBUMART_COMMANDS = ['albumart', 'readpicture']
+    # Timeout for loading album art (in seconds)
+    ALBUMART_TIMEOUT = 30
+    # Action priority: interactive commands
+    PRIORITY_INTERACTIVE = 0
+    # Action priority: all other actions
+    PRIORITY_DEFAULT = 1
     # Signal: connection status
     SIGNAL_CONNECTION = 'connection'
     # Signal: status
@@ -112,30 +147,59 @@ class Client(Base):
     SIGNAL_STATS = 'stats'
     # Signal: load albums
     SIGNAL_LOAD_ALBUMS = 'load-albums'
+    # Signal: refresh albums
+    SIGNAL_REFRESH_ALBUMS = 'refresh-albums'
     # Signal: load playlist
     SIGNAL_LOAD_PLAYLIST = 'load-playlist'
+    # Signal: update playlist
+    SIGNAL_UPDATE_PLAYLIST = 'update-playlist'
     # Signal: load audio output devices
     SIGNAL_LOAD_OUTPUT_DEVICES = 'load-output-devices'
     # Signal: error
     SIGNAL_ERROR = 'error'
-
-
-    def __init__(self):
-        """Set class variables and instantiates the Client."""
+    # Signals forwarded from bulk connections
+    BULK_SIGNALS = [
+        SIGNAL_LOAD_ALBUMS,
+        SIGNAL_REFRESH_ALBUMS,
+        SIGNAL_LOAD_PLAYLIST,
+        SIGNAL_UPDATE_PLAYLIST,
+        SIGNAL_ERROR
+    ]
+
+
+    def __init__(self, handle_idle=True):
+        """Set class variables and instantiates the Client. A client which
+        does not handle idle events can be used as bulk connection.
+        """
         Base.__init__(self)
         self._logger = logging.getLogger(__name__)
         self._sock = None
         self._sock_read = None
         self._sock_write = None
-        self._stop = threading.Event()
-        self._actions = queue.Queue()
+        self._stop_event = threading.Event()
+        self._actions = queue.PriorityQueue()
+        self._action_counter = itertools.count()
         self._worker = None
         self._idling = False
+        self._idle_lock = threading.Lock()
         self._host = None
         self._albums = {}
+        self._shared_values = {}
+        self._db_update = None
         self._playlist = []
+        self._playlist_songs = []
+        self._playlist_version = None
         self._image_dir = ""
         self._state = None
+        self._bulk_loading = True
+        self._albumart = False
+        self._unsupported_commands = set()
+        self._connection = None
+        self._quiet_disconnect = False
+        self._handle_idle = handle_idle
+        self._bulk_connections = 0
+        self._bulk_clients = []
+        self._bulk_counter = itertools.count()
 
 
     def get_logger(self):
@@ -151,8 +215,10 @@ class Client(Base):
         self._logger.info("connect")
         self._host = host
         self._image_dir = image_dir
+        self._bulk_loading = True
+        self._playlist_version = None
         self._add_action(self._connect, host, port, password)
-        self._stop.clear()
+        self._stop_event.clear()
         self._start_worker()
 
 
@@ -164,30 +230,43 @@ class Client(Base):
     def disconnect(self):
         """Disconnect from the connected MPD."""
         self._logger.info("disconnect")
-        self._stop.set()
+        self._stop_event.set()
         self._add_action(self._disconnect)
+        bulk_clients = self._bulk_clients
+        self._bulk_clients = []
+        for bulk_client in bulk_clients:
+            bulk_client.disconnect()
 
 
     def join(self):
+        for bulk_client in self._bulk_clients:
+            bulk_client.join()
         self._actions.join()
 
 
+    def set_bulk_connections(self, count):
+        """Set the number of additional connections for library, playlist
+        and album art queries. The number is applied on the next connect.
+        """
+        self._bulk_connections = count
+
+
     def get_status(self):
         """Determine the current status."""
         self._logger.info("get status")
-        self._add_action(self._get_status)
+        self._add_refresh(self._get_status)
 
 
     def get_stats(self):
         """Load statistics."""
         self._logger.info("get stats")
-        self._add_action(self._get_stats)
+        self._add_refresh(self._get_stats)
 
 
     def get_output_devices(self):
         """Determine the list of audio output devices."""
         self._logger.info("get output devices")
-        self._add_action(self._get_output_devices)
+        self._add_refresh(self._get_output_devices)
 
 
     def enable_output_device(self, device, enabled):
@@ -199,7 +278,15 @@ class Client(Base):
 
     def load_albums(self):
         self._logger.info("load albums")
-        self._add_action(self._load_albums)
+        library_client = self._get_library_client()
+        library_client._add_refresh(library_client._load_albums)
+
+
+    def refresh_albums(self):
+        """Reload the albums and report only the changes."""
+        self._logger.info("refresh albums")
+        library_client = self._get_library_client()
+        library_client._add_refresh(library_client._refresh_albums)
 
 
     def update(self):
@@ -209,7 +296,8 @@ class Client(Base):
 
     def load_playlist(self):
         self._logger.info("load playlist")
-        self._add_action(self._load_playlist)
+        library_client = self._get_library_client()
+        library_client._add_refresh(library_client._load_playlist)
 
 
     def clear_playlist(self):
@@ -239,7 +327,7 @@ class Client(Base):
     def playpause(self):
         """Play or pauses the current state."""
         self._logger.info("playpause")
-        self._add_action(self._playpause)
+        self._add_interactive_action(self._playpause)
 
 
     def play_album(self, album):
@@ -257,39 +345,127 @@ class Client(Base):
     def seek(self, pos, time):
         """Seeks to a song at a position"""
         self._logger.info("seek")
-        self._add_action(self._seek, pos, time)
+        self._add_interactive_action(self._seek, pos, time)
 
 
     def stop(self):
         self._logger.info("stop")
-        self._add_action(self._stop)
+        self._add_interactive_action(self._stop)
 
 
     def set_volume(self, volume):
         self._logger.info("set volume")
-        self._add_action(self._set_volume, volume)
+        self._add_interactive_action(self._set_volume, volume)
+
+
+    def get_albumart(self, file):
+        """Load the album art of a file from MPD.
+
+        This method blocks until the image data has been loaded and returns
+        the data or None. It must not be called from the worker thread.
+        """
+        self._logger.info("get albumart")
+        albumart_client = self._get_albumart_client()
+        if albumart_client._sock is None:
+            return None
+        future = concurrent.futures.Future()
+        albumart_client._add_action(albumart_client._get_albumart, file, future)
+        try:
+            return future.result(Client.ALBUMART_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            self._logger.info("loading albumart timed out")
+            return None
 
 
     # Private methods
 
+    def _connect_bulk_clients(self, host, port, password):
+        """Open the bulk connections. A connection which fails is
+        skipped.
+        """
+        bulk_clients = self._bulk_clients
+        self._bulk_clients = []
+        for bulk_client in bulk_clients:
+            bulk_client.disconnect()
+        bulk_clients = []
+        for i in range(self._bulk_connections):
+            bulk_client = Client(False)
+            for signal in Client.BULK_SIGNALS:
+                bulk_client.connect_signal(signal, functools.partial(self._callback, signal))
+            bulk_client._host = self._host
+            bulk_client._image_dir = self._image_dir
+            try:
+                bulk_client._connect(host, port, password)
+            except MPDException as e:
+                self._logger.info("bulk connection failed: %s", e)
+                continue
+            bulk_client.connect_signal(Client.SIGNAL_CONNECTION, functools.partial(self._on_bulk_connection, bulk_client))
+            bulk_client._start_worker()
+            bulk_clients.append(bulk_client)
+        self._bulk_clients = bulk_clients
+        self._logger.info("%d bulk connections", len(bulk_clients))
+
+
+    def _on_bulk_connection(self, bulk_client, status):
+        if not status and bulk_client in self._bulk_clients:
+            self._logger.info("bulk connection lost")
+            self.disconnect()
+
+
+    def _get_library_client(self):
+        """Return the client to load the library and the playlist with."""
+        bulk_clients = self._bulk_clients
+        if bulk_clients:
+            return bulk_clients[0]
+        return self
+
+
+    def _get_albumart_client(self):
+        """Return the client to load the next album art with."""
+        bulk_clients = self._bulk_clients
+        if bulk_clients:
+            return bulk_clients[next(self._bulk_counter) % len(bulk_clients)]
+        return self
+
+
     def _connect(self, host, port, password):
         self._logger.info("connecting to host %r, port %r", host, port)
         if self._sock is not None:
             return
         try:
-            self._sock = self._connect_socket(host, port)
-            self._sock_read = self._sock.makefile("r", encoding="utf-8")
-            self._sock_write = self._sock.makefile("w", encoding="utf-8")
-            self._greet()
-            self._logger.info("connected")
-            if password:
-                self._logger.info("setting password")
-                self._call("password", password)
+            self._open(host, port, password)
+            self._connect_bulk_clients(host, port, password)
             self._set_connection_status(True)
         except OSError as e:
             raise ConnectionException("connection failed: {}".format(e))
 
 
+    def _open(self, host, port, password):
+        """Open the socket, read the greeting and authenticate."""
+        self._connection = (host, port, password)
+        self._sock = self._connect_socket(host, port)
+        self._sock_read = self._sock.makefile("rb")
+        self._sock_write = self._sock.makefile("w", encoding="utf-8")
+        self._greet()
+        self._logger.info("connected")
+        if password:
+            self._logger.info("setting password")
+            self._call("password", password)
+
+
+    def _reopen(self):
+        """Open the connection again after MPD closed it without
+        reporting the loss of the connection.
+        """
+        self._logger.info("reconnecting")
+        try:
+            self._open(*self._connection)
+        except (OSError, MPDException) as e:
+            self._quiet_disconnect = False
+            self._disconnect_socket()
+            raise ConnectionException("reconnection failed: {}".format(e))
+
+
     def _connect_socket(self, host, port):
         sock = None
         error = None
@@ -312,16 +488,23 @@ class Client(Base):
 
 
     def _greet(self):
-        greeting = self._sock_read.readline()
+        greeting = self._readline()
         self._logger.debug("greeting: %s", greeting.strip())
-        if not greeting.endswith("\n"):
-            self._disconnect_socket()
-            raise ConnectionException("incomplete line")
         if not greeting.startswith(Client.PROTOCOL_GREETING):
             self._disconnect_socket()
             raise ProtocolException("invalid greeting: {}".format(greeting))
         self._protocol_version = greeting[len(Client.PROTOCOL_GREETING):].strip()
         self._logger.debug("protocol version: %s", self._protocol_version)
+        self._albumart = self._check_protocol_version(0, 21)
+        self._unsupported_commands = set()
+
+
+    def _check_protocol_version(self, major, minor):
+        try:
+            version = [int(part) for part in self._protocol_version.split('.')]
+        except ValueError:
+            return False
+        return version[:2] >= [major, minor]
 
 
     def _disconnect(self):
@@ -346,35 +529,53 @@ class Client(Base):
     def _idle(self):
         """React to idle events from MPD."""
         self._logger.info("idle")
-        self._idling = True
-        subsystems = self._parse_dict(self._call("idle"))
-        self._idling = False
+        with self._idle_lock:
+            # Do not idle if an action has been added in the meantime
+            if not self._actions.empty():
+                return
+            self._write("idle")
+            self._idling = True
+        try:
+            response = self._read()
+        except MPDException as e:
+            if e.get_error() == Client.PROTOCOL_ERROR_PERMISSION:
+                self.disconnect()
+            self._callback(Client.SIGNAL_ERROR, e)
+            response = None
+        finally:
+            with self._idle_lock:
+                self._idling = False
+        subsystems = self._parse_values(response, 'changed')
         self._logger.info("idle subsystems: %r", subsystems)
-        if subsystems:
-            if subsystems['changed'] == 'player':
-                self.get_status()
-                self.load_playlist()
-            if subsystems['changed'] == 'mixer':
-                self.get_status()
-            if subsystems['changed'] == 'playlist':
-                self.load_playlist()
-            if subsystems['changed'] == 'database':
-                self.load_albums()
-                self.load_playlist()
-                self.get_status()
-            if subsystems['changed'] == 'update':
-                self.load_albums()
-                self.load_playlist()
-                self.get_status()
-            if subsystems['changed'] == 'output':
-                self.get_output_devices()
-                self.get_status()
+        if not self._handle_idle:
+            # Bulk connections only idle to keep the connection open
+            return
+        if 'player' in subsystems:
+            # Status reloads the playlist if its version changed
+            self.get_status()
+        if 'mixer' in subsystems:
+            self.get_status()
+        if 'playlist' in subsystems:
+            self.load_playlist()
+        if 'database' in subsystems:
+            self.refresh_albums()
+            self.load_playlist()
+            self.get_status()
+        if 'update' in subsystems:
+            self.refresh_albums()
+            self.load_playlist()
+            self.get_status()
+        if 'output' in subsystems:
+            self.get_output_devices()
+            self.get_status()
 
 
     def _noidle(self):
-        if self._idling:
-            self._logger.debug("noidle")
-            self._write("noidle")
+        with self._idle_lock:
+            if self._idling:
+                self._logger.debug("noidle")
+                self._write("noidle")
+                self._idling = False
 
 
     def _get_status(self):
@@ -388,6 +589,10 @@ class Client(Base):
         if 'state' in status:
             state = status['state']
         self._state = state
+        # Playlist
+        library_client = self._get_library_client()
+        if 'playlist' in status and library_client._playlist_version is not None and status['playlist'] != library_client._playlist_version:
+            self.load_playlist()
         # Time
         time = 0
         if 'time' in status:
@@ -414,9 +619,12 @@ class Client(Base):
             if track:
                 # Album
                 album = self._extract_album(song)
+                library_albums = library_client._albums
+                if album.get_hash() in library_albums:
+                    album = library_albums[album.get_hash()]
                 # Position
                 pos = track.get_pos()
-                for palbum in self._playlist:
+                for palbum in library_client._playlist:
                     if palbum == album and len(palbum.get_tracks()) >= pos:
                         album = palbum
                         break
@@ -485,11 +693,120 @@ class Client(Base):
 
     def _load_albums(self):
         """Action: Perform the real update."""
-        self._albums = {}
+        # Use snapshot if the database has not changed
+        stats = self._parse_dict(self._call('stats'))
+        db_update = stats.get('db_update')
+        library_cache = MCGLibraryCache(self._host)
+        albums = library_cache.load(db_update, self._image_dir)
+        if albums is not None:
+            self._logger.info("using library snapshot from %s", db_update)
+            self._albums = albums
+            self._db_update = db_update
+            self._callback(Client.SIGNAL_LOAD_ALBUMS, self._albums)
+            return
+
+        self._albums = yield from self._fetch_albums()
+        self._db_update = db_update
+        library_cache.save(db_update, self._image_dir, self._albums)
+        self._callback(Client.SIGNAL_LOAD_ALBUMS, self._albums)
+
+
+    def _refresh_albums(self):
+        """Action: Reload the albums and determine the changes."""
+        stats = self._parse_dict(self._call('stats'))
+        db_update = stats.get('db_update')
+        if db_update is not None and db_update == self._db_update:
+            self._logger.info("database unchanged")
+            return
+
+        old_albums = self._albums
+        albums = yield from self._fetch_albums()
+        added = []
+        changed = []
+        for hash, album in albums.items():
+            if hash not in old_albums:
+                added.append(hash)
+            elif self._album_changed(old_albums[hash], album):
+                changed.append(hash)
+            else:
+                # Keep old instance to retain its cover state
+                albums[hash] = old_albums[hash]
+        removed = [hash for hash in old_albums.keys() if hash not in albums]
+        # The covers of changed albums might have been moved
+        cover_index = MCGCoverIndex.get(self._host, self._image_dir)
+        for hash in removed + changed:
+            cover_index.remove(hash)
+        self._albums = albums
+        self._logger.info("albums: %d added, %d removed, %d changed", len(added), len(removed), len(changed))
+        self._db_update = db_update
+        MCGLibraryCache(self._host).save(db_update, self._image_dir, self._albums)
+        self._callback(Client.SIGNAL_REFRESH_ALBUMS, self._albums, added, removed, changed)
+
+
+    def _fetch_albums(self):
+        """Query all albums from MPD and return them. This is a generator
+        which yields between the queries to let interactive actions run.
+        The albums are collected separately, so the current albums stay
+        available until the load is complete.
+        """
+        albums = {}
+        self._shared_values = {}
+        if self._bulk_loading:
+            # MPD closes the connection if a listing exceeds its output
+            # buffer, do not report this as loss of the connection.
+            self._quiet_disconnect = True
+            try:
+                yield from self._load_albums_bulk(albums)
+            except CommandException as e:
+                self._logger.info("bulk loading failed, falling back: %s", e)
+                self._bulk_loading = False
+                albums = {}
+            except ConnectionException as e:
+                self._logger.info("bulk loading closed the connection, falling back: %s", e)
+                self._bulk_loading = False
+                albums = {}
+                self._reopen()
+            finally:
+                self._quiet_disconnect = False
+        if not self._bulk_loading:
+            yield from self._load_albums_single(albums)
+        return albums
+
+
+    def _load_albums_bulk(self, albums):
+        """Load all albums with one listing per top-level directory."""
+        directories = []
+        self._write('lsinfo')
+        for entry in self._parse_list(self._read(), ['file', 'directory', 'playlist']):
+            if 'directory' in entry:
+                directories.append(entry['directory'])
+            elif 'file' in entry:
+                self._add_album_song(entry, albums)
+        for directory in directories:
+            yield
+            if self._sock is None:
+                raise ConnectionException("connection closed")
+            self._write('listallinfo', [directory])
+            for song in self._parse_list(self._read(), ['file', 'directory', 'playlist']):
+                if 'file' in song:
+                    self._add_album_song(song, albums)
+
+
+    def _add_album_song(self, song, albums):
+        track = self._extract_track(song)
+        if track:
+            self._logger.debug("track: %r", track)
+            album = self._extract_album(song, albums)
+            album.add_track(track)
+
+
+    def _load_albums_single(self, albums):
+        """Load all albums with one query per album."""
         # Albums
         for album in self._parse_list(self._call('list album'), ['album']):
+            yield
             # Album
-            album = self._extract_album(album)
+            album = self._extract_album(album, albums)
             self._logger.debug("album: %r", album)
             # Tracks
             for song in self._parse_list(self._call('find album ', album.get_title()), ['file']):
@@ -497,7 +814,13 @@ class Client(Base):
                 if track:
                     self._logger.debug("track: %r", track)
                     album.add_track(track)
-        self._callback(Client.SIGNAL_LOAD_ALBUMS, self._albums)
+
+
+    def _album_changed(self, album1, album2):
+        """Check if the tracks of two versions of an album differ."""
+        tracks1 = [(track.get_file(), track.get_last_modified()) for track in album1.get_tracks()]
+        tracks2 = [(track.get_file(), track.get_last_modified()) for track in album2.get_tracks()]
+        return tracks1 != tracks2
 
 
     def _update(self):
@@ -505,22 +828,98 @@ class Client(Base):
 
 
     def _load_playlist(self):
-        self._playlist = []
-        for song in self._parse_list(self._call('playlistinfo'), ['file', 'playlist']):
+        """Action: Load the playlist. After the first load only the songs
+        changed since the last known playlist version are fetched.
+        """
+        status = self._parse_dict(self._call('status'))
+        version = status.get('playlist')
+        length = int(status.get('playlistlength', 0))
+        songs = None
+        if self._playlist_version is not None and version is not None:
+            if version == self._playlist_version:
+                return
+            songs = self._load_playlist_changes(length)
+        full = songs is None
+        if full:
+            songs = list(self._parse_list(self._call('playlistinfo'), ['file', 'playlist']))
+
+        previous = self._playlist
+        self._playlist = self._group_playlist(songs)
+        self._playlist_songs = songs
+        self._playlist_version = version
+        if full:
+            self._callback(Client.SIGNAL_LOAD_PLAYLIST, self._playlist)
+        else:
+            start, removed, added = self._diff_playlist(previous, self._playlist)
+            if removed or added:
+                self._callback(Client.SIGNAL_UPDATE_PLAYLIST, self._playlist, start, removed, added)
+
+
+    def _load_playlist_changes(self, length):
+        """Apply the songs changed since the last playlist version to the
+        known songs. Return None if the changes do not fit.
+        """
+        songs = self._playlist_songs[:length]
+        for song in self._parse_list(self._call('plchanges', self._playlist_version), ['file', 'playlist']):
+            if 'pos' not in song:
+                return None
+            pos = int(song['pos'])
+            if pos < len(songs):
+                songs[pos] = song
+            elif pos == len(songs):
+                songs.append(song)
+            else:
+                return None
+        if len(songs) != length:
+            return None
+        return songs
+
+
+    def _group_playlist(self, songs):
+        previous_albums = {}
+        if self._playlist:
+            for album in self._playlist:
+                previous_albums[album.get_hash()] = album
+        playlist = []
+        for song in songs:
             self._logger.debug("song: %r", song)
             # Track
             track = self._extract_playlist_track(song)
             self._logger.debug("track: %r", track)
             # Album
-            album = self._extract_album(song, lookup=False)
-            if len(self._playlist) == 0 or self._playlist[len(self._playlist)-1].get_hash() != album.get_hash():
-                self._playlist.append(album)
+            album = self._extract_album(song)
+            if len(playlist) == 0 or playlist[len(playlist)-1].get_hash() != album.get_hash():
+                # Reuse the cover of the library or previous playlist album
+                if self._albums and album.get_hash() in self._albums:
+                    album.set_cover_source(self._albums[album.get_hash()])
+                elif album.get_hash() in previous_albums:
+                    album.set_cover_source(previous_albums[album.get_hash()])
+                playlist.append(album)
             else:
-                album = self._playlist[len(self._playlist)-1]
+                album = playlist[len(playlist)-1]
             self._logger.debug("album: %r", album)
             if track:
                 album.add_track(track)
-        self._callback(Client.SIGNAL_LOAD_PLAYLIST, self._playlist)
+        return playlist
+
+
+    def _diff_playlist(self, playlist1, playlist2):
+        """Return the start, the number of removed albums and the added
+        albums of the range in which two playlists differ.
+        """
+        keys1 = [self._playlist_album_key(album) for album in playlist1]
+        keys2 = [self._playlist_album_key(album) for album in playlist2]
+        start = 0
+        while start < len(keys1) and start < len(keys2) and keys1[start] == keys2[start]:
+            start = start + 1
+        end = 0
+        while end < len(keys1) - start and end < len(keys2) - start and keys1[-end-1] == keys2[-end-1]:
+            end = end + 1
+        return start, len(keys1) - start - end, playlist2[start:len(playlist2)-end]
+
+
+    def _playlist_album_key(self, album):
+        return (album.get_hash(), tuple(track.get_id() for track in album.get_tracks()))
 
 
     def _clear_playlist(self):
@@ -559,39 +958,87 @@ class Client(Base):
 
 
     def _play_album(self, album):
-        if album in self._albums:
-            track_ids = []
-            for track in self._albums[album].get_tracks():
-                self._logger.info("addid: %r", track.get_file())
-                track_id = None
-                track_id_response = self._parse_dict(self._call('addid', track.get_file()))
-                if 'id' in track_id_response:
-                    track_id = track_id_response['id']
-                self._logger.debug("track id: %r", track_id)
-                if track_id is not None:
-                    track_ids.append(track_id)
-            if self._state != 'play' and track_ids:
-                self._call('playid', track_ids[0])
+        self._play_albums([album])
 
 
     def _play_albums(self, albums):
-        track_ids = []
+        files = []
+        library_albums = self._get_library_client()._albums
         for album in albums:
             self._logger.info("add album %s", album)
-            if album in self._albums:
-                for track in self._albums[album].get_tracks():
+            if album in library_albums:
+                for track in library_albums[album].get_tracks():
                     self._logger.info("addid: %r", track.get_file())
-                    track_id = None
-                    track_id_response = self._parse_dict(self._call('addid', track.get_file()))
-                    if 'id' in track_id_response:
-                        track_id = track_id_response['id']
-                    self._logger.debug("track id: %r", track_id)
-                    if track_id is not None:
-                        track_ids.append(track_id)
+                    files.append(track.get_file())
+        if not files:
+            return
+
+        # Add all tracks with one command list and add the remaining
+        # tracks again if one of them fails
+        track_ids = []
+        while files:
+            self._call_list('command_list_ok_begin')
+            for file in files:
+                self._call_list('addid', file)
+            try:
+                self._write('command_list_end')
+                response = self._read()
+                files = []
+            except CommandException as e:
+                self._callback(Client.SIGNAL_ERROR, e)
+                response = e.get_response()
+                failed = e.get_command_number()
+                if failed is not None and failed < len(files):
+                    self._logger.warning("cannot add %r", files[failed])
+                    files = files[failed+1:]
+                else:
+                    files = []
+            except MPDException as e:
+                self._callback(Client.SIGNAL_ERROR, e)
+                return
+            for track_id_response in self._split_list(response):
+                track_id = self._parse_dict(track_id_response).get('id')
+                self._logger.debug("track id: %r", track_id)
+                if track_id is not None:
+                    track_ids.append(track_id)
         if self._state != 'play' and track_ids:
             self._call('playid', track_ids[0])
 
 
+    def _get_albumart(self, file, future):
+        """Action: Perform the real loading of album art."""
+        data = None
+        try:
+            for command in Client.ALBUMART_COMMANDS:
+                if command in self._unsupported_commands:
+                    continue
+                try:
+                    data = self._read_picture(command, file)
+                except CommandException as e:
+                    if e.get_error() == Client.PROTOCOL_ERROR_UNKNOWN:
+                        self._unsupported_commands.add(command)
+                if data:
+                    break
+        finally:
+            future.set_result(data)
+
+
+    def _read_picture(self, command, file):
+        """Load an image chunk by chunk with albumart or readpicture."""
+        data = bytearray()
+        size = None
+        while size is None or len(data) < size:
+            self._write(command, (file, len(data)))
+            response, chunk = self._read_binary()
+            if not chunk:
+                break
+            size = int(self._parse_dict(response)['size'])
+            data.extend(chunk)
+        if not data:
+            return None
+        return bytes(data)
+
+
     def _seek(self, pos, time):
         self._call('seek', pos, time)
 
@@ -614,7 +1061,7 @@ class Client(Base):
 
 
     def _run(self):
-        while not self._stop.is_set() or not self._actions.empty():
+        while not self._stop_event.is_set() or not self._actions.empty():
             if self._sock is not None and self._actions.empty():
                 self._add_action(self._idle)
             action = self._actions.get()
@@ -625,19 +1072,57 @@ class Client(Base):
         self._logger.debug("worker finished")
 
 
+    def _work_interactive(self):
+        """Perform the waiting interactive actions in between the steps
+        of a long running action.
+        """
+        while True:
+            with self._actions.mutex:
+                if not self._actions.queue or self._actions.queue[0][0] > Client.PRIORITY_INTERACTIVE:
+                    return
+            action = self._actions.get()
+            self._logger.debug("next interactive action: %r", action)
+            self._work(action)
+            self._actions.task_done()
+
+
     def _add_action(self, method, *args):
         """Add an action to the action list."""
+        self._put_action(Client.PRIORITY_DEFAULT, method, args)
+
+
+    def _add_interactive_action(self, method, *args):
+        """Add an action which is performed before all other actions."""
+        self._put_action(Client.PRIORITY_INTERACTIVE, method, args)
+
+
+    def _put_action(self, priority, method, args):
         self._logger.debug("add action %r (%r)", method.__name__, args)
-        action = (method, args)
+        action = (priority, next(self._action_counter), method, args)
         self._actions.put(action)
         self._noidle()
 
 
+    def _add_refresh(self, method):
+        """Add an action which reloads data unless the same action is
+        still waiting in the action list.
+        """
+        with self._actions.mutex:
+            if any(action[2] == method and not action[3] for action in self._actions.queue):
+                self._logger.debug("skip queued action %r", method.__name__)
+                return
+        self._add_action(method)
+
+
     def _work(self, action):
-        (method, args) = action
+        (priority, number, method, args) = action
         self._logger.debug("work: %r", method.__name__)
         try:
-            method(*args)
+            result = method(*args)
+            if inspect.isgenerator(result):
+                # Let interactive actions run between the steps
+                for step in result:
+                    self._work_interactive()
         except ConnectionException as e:
             self._logger.exception(e)
             self._callback(Client.SIGNAL_ERROR, e)
@@ -679,26 +1164,70 @@ class Client(Base):
     def _read(self):
         self._logger.debug("reading response")
         response = []
-        line = self._sock_read.readline()
-        if not line.endswith("\n"):
-            self._disconnect_socket()
-            raise ConnectionException("incomplete line")
+        line = self._readline()
         while not line.startswith(Client.PROTOCOL_COMPLETION) and not line.startswith(Client.PROTOCOL_ERROR):
             response.append(line.strip())
-            line = self._sock_read.readline()
-            if not line.endswith("\n"):
-                self._disconnect_socket()
-                raise ConnectionException("incomplete line")
+            line = self._readline()
         if line.startswith(Client.PROTOCOL_COMPLETION):
             self._logger.debug("response complete")
         if line.startswith(Client.PROTOCOL_ERROR):
             error = line[len(Client.PROTOCOL_ERROR):].strip()
             self._logger.debug("command failed: %r", error)
-            raise CommandException(error)
+            raise CommandException(error, response)
         self._logger.debug("response: %r", response)
         return response
 
 
+    def _split_list(self, response):
+        """Split the response of a command list into the responses of
+        the single commands.
+        """
+        responses = []
+        if response:
+            current = []
+            for line in response:
+                if line == Client.PROTOCOL_LIST_COMPLETION:
+                    responses.append(current)
+                    current = []
+                else:
+                    current.append(line)
+        return responses
+
+
+    def _read_binary(self):
+        """Read a response which contains a chunk of binary data and
+        return the response and the data.
+        """
+        self._logger.debug("reading binary response")
+        response = []
+        data = None
+        line = self._readline()
+        while not line.startswith(Client.PROTOCOL_COMPLETION) and not line.startswith(Client.PROTOCOL_ERROR):
+            key, value = self._split_line(line.strip())
+            if key == Client.PROTOCOL_BINARY:
+                length = int(value)
+                data = self._sock_read.read(length)
+                if data is None or len(data) != length or self._sock_read.read(1) != b'\n':
+                    self._disconnect_socket()
+                    raise ConnectionException("incomplete binary data")
+            else:
+                response.append(line.strip())
+            line = self._readline()
+        if line.startswith(Client.PROTOCOL_ERROR):
+            error = line[len(Client.PROTOCOL_ERROR):].strip()
+            self._logger.debug("command failed: %r", error)
+            raise CommandException(error)
+        return response, data
+
+
+    def _readline(self):
+        line = self._sock_read.readline().decode('utf-8')
+        if not line.endswith("\n"):
+            self._disconnect_socket()
+            raise ConnectionException("incomplete line")
+        return line
+
+
     def _parse_dict(self, response):
         dict = {}
         if response:
@@ -708,6 +1237,19 @@ class Client(Base):
         return dict
 
 
+    def _parse_values(self, response, key):
+        """Return all values of the given key in the order of the
+        response.
+        """
+        values = []
+        if response:
+            for line in response:
+                line_key, value = self._split_line(line)
+                if line_key == key:
+                    values.append(value)
+        return values
+
+
     def _parse_list(self, response, delimiters):
         entry = {}
         if response:
@@ -731,24 +1273,24 @@ class Client(Base):
         return parts[0].lower(), ':'.join(parts[1:]).lstrip()
 
 
-    def _extract_album(self, song, lookup=True):
+    def _extract_album(self, song, albums=None):
         album = None
         if 'album' not in song:
             song['album'] = MCGAlbum.DEFAULT_ALBUM
         hash = MCGAlbum.hash(song['album'])
-        if lookup and hash in self._albums.keys():
-            album = self._albums[hash]
+        if albums is not None and hash in albums:
+            album = albums[hash]
         else:
-            album = MCGAlbum(song['album'], self._host, self._image_dir)
-        if lookup:
-            self._albums[hash] = album
+            album = MCGAlbum(song['album'], self._host, self._image_dir, self._albumart)
+        if albums is not None:
+            albums[hash] = album
         return album
 
 
     def _extract_track(self, song):
         track = None
         if 'artist' in song and 'title' in song and 'file' in song:
-            track = MCGTrack(song['artist'], song['title'], song['file'])
+            track = MCGTrack(song['artist'], song['title'], song['file'], self._shared_values)
             if 'track' in song:
                 track.set_track(song['track'])
             if 'time' in song:
@@ -756,7 +1298,9 @@ class Client(Base):
             if 'date' in song:
                 track.set_date(song['date'])
             if 'albumartist' in song:
-                track.set_albumartists(song['albumartist'])
+                track.set_albumartists(song['albumartist'], self._shared_values)
+            if 'last-modified' in song:
+                track.set_last_modified(song['last-modified'])
         return track
 
 
@@ -768,6 +1312,8 @@ class Client(Base):
 
 
     def _set_connection_status(self, status):
+        if not status and self._quiet_disconnect:
+            return
         self._callback(Client.SIGNAL_CONNECTION, status)
 
 
@@ -801,26 +1347,47 @@ class OutputDevice:
 
 
 class MCGAlbum:
+    __slots__ = (
+        '_artists',
+        '_albumartists',
+        '_pathes',
+        '_title',
+        '_dates',
+        '_host',
+        '_image_dir',
+        '_albumart',
+        '_tracks',
+        '_length',
+        '_cover',
+        '_cover_searched',
+        '_cover_source',
+        '_hash',
+        '_views'
+    )
     DEFAULT_ALBUM = 'Various'
     _FILE_NAMES = ['cover', 'folder']
     _FILE_EXTS = ['jpg', 'png', 'jpeg']
     _FILTER_DELIMITER = ' '
 
 
-    def __init__(self, title, host, image_dir):
-        self._artists = []
-        self._albumartists = []
-        self._pathes = []
+    def __init__(self, title, host, image_dir, albumart=False):
+        # Values are collected as keys of dicts to keep their order
+        self._artists = {}
+        self._albumartists = {}
+        self._pathes = {}
         if type(title) is list:
             title = title[0]
         self._title = title
-        self._dates = []
+        self._dates = {}
         self._host = host
         self._image_dir = image_dir
+        self._albumart = albumart
         self._tracks = []
         self._length = 0
         self._cover = None
         self._cover_searched = False
+        self._cover_source = None
+        self._views = {}
         self._set_hash()
 
 
@@ -828,16 +1395,45 @@ class MCGAlbum:
         return self._hash == other.get_hash()
 
 
+    def __getstate__(self):
+        # Leave out the cover state so covers are searched again
+        state = {}
+        for name in MCGAlbum.__slots__:
+            state[name] = getattr(self, name)
+        state['_cover'] = None
+        state['_cover_searched'] = False
+        state['_cover_source'] = None
+        state['_views'] = {}
+        return state
+
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
     def get_artists(self):
-        if self._albumartists:
-            return [artist for artist in self._artists if artist not in self._albumartists]
-        return self._artists
+        if 'artists' not in self._views:
+            if self._albumartists:
+                self._views['artists'] = tuple(artist for artist in self._artists if artist not in self._albumartists)
+            else:
+                self._views['artists'] = tuple(self._artists)
+        return self._views['artists']
 
 
     def get_albumartists(self):
-        if self._albumartists:
-            return self._albumartists
-        return self._artists
+        if 'albumartists' not in self._views:
+            if self._albumartists:
+                self._views['albumartists'] = tuple(self._albumartists)
+            else:
+                self._views['albumartists'] = tuple(self._artists)
+        return self._views['albumartists']
+
+
+    def get_artists_label(self):
+        if 'artists_label' not in self._views:
+            self._views['artists_label'] = Utils.create_artists_label(self)
+        return self._views['artists_label']
 
 
     def get_title(self):
@@ -845,13 +1441,22 @@ class MCGAlbum:
 
 
     def get_dates(self):
-        return self._dates
+        if 'dates' not in self._views:
+            self._views['dates'] = tuple(self._dates)
+        return self._views['dates']
+
+
+    def get_dates_label(self):
+        if 'dates_label' not in self._views:
+            self._views['dates_label'] = ', '.join(self.get_dates())
+        return self._views['dates_label']
 
 
     def get_date(self):
-        if len(self._dates) == 0:
+        dates = self.get_dates()
+        if len(dates) == 0:
             return None
-        return self._dates[0]
+        return dates[0]
 
 
     def get_path(self):
@@ -862,16 +1467,13 @@ class MCGAlbum:
         self._tracks.append(track)
         self._length = self._length + track.get_length()
         for artist in track.get_artists():
-            if artist not in self._artists:
-                self._artists.append(artist)
+            self._artists[artist] = None
         for artist in track.get_albumartists():
-            if artist not in self._albumartists:
-                self._albumartists.append(artist)
-        if track.get_date() is not None and track.get_date() not in self._dates:
-            self._dates.append(track.get_date())
-        path = os.path.dirname(track.get_file())
-        if path not in self._pathes:
-            self._pathes.append(path)
+            self._albumartists[artist] = None
+        if track.get_date() is not None:
+            self._dates[track.get_date()] = None
+        self._pathes[os.path.dirname(track.get_file())] = None
+        self._views = {}
 
 
     def get_tracks(self):
@@ -884,10 +1486,33 @@ class MCGAlbum:
 
     def get_cover(self):
         if self._cover is None and not self._cover_searched:
-            self._find_cover()
+            if self._cover_source is not None:
+                self._cover = self._cover_source.get_cover()
+                self._cover_searched = True
+            else:
+                self._find_cover()
         return self._cover
 
 
+    def forget_cover(self):
+        """Discard the cover found for the album, e.g. because it could
+        not be loaded, so that it is searched again.
+        """
+        MCGCoverIndex.get(self._host, self._image_dir).remove(self._hash)
+        self._cover = None
+        self._cover_searched = False
+        self._cover_source = None
+
+
+    def set_cover_source(self, album):
+        """Take the cover from another instance of the same album
+        instead of searching for it again.
+        """
+        if album._cover_source is not None:
+            album = album._cover_source
+        self._cover_source = album
+
+
     def hash(title):
         if type(title) is list:
             title = title[0]
@@ -908,7 +1533,7 @@ class MCGAlbum:
             result = False
             keyword = keyword.lower()
             # Search in album data
-            for value in self._artists + [self._title] + self._dates:
+            for value in list(self._artists) + [self._title] + list(self._dates):
                 if keyword in value.lower():
                     result = True
                     break
@@ -924,6 +1549,15 @@ class MCGAlbum:
         return True
 
 
+    def get_filter_values(self):
+        """Return the values the album can be filtered by."""
+        values = list(self._artists) + [self._title] + list(self._dates)
+        for track in self._tracks:
+            values.append(track.get_title())
+            values.append(track.get_file())
+        return values
+
+
     def compare(album1, album2, criterion=None):
         if criterion == None:
             criterion = SortOrder.TITLE
@@ -961,11 +1595,23 @@ class MCGAlbum:
         if self._host == "localhost" or self._host == "127.0.0.1" or self._host == "::1":
             self._cover = self._find_cover_local(names)
         else:
-            self._cover = self._find_cover_web(names)
+            cover_index = MCGCoverIndex.get(self._host, self._image_dir)
+            found, url = cover_index.lookup(self._hash)
+            if not found:
+                url, complete = self._find_cover_web(names)
+                if complete:
+                    cover_index.set(self._hash, url)
+            self._cover = url
+        if self._cover is None and self._albumart and self._tracks:
+            self._cover = Utils.ALBUMART_SCHEME + self._tracks[0].get_file()
         self._cover_searched = True
 
 
     def _find_cover_web(self, names):
+        """Return the URL of the cover (or None) and whether all
+        candidates could be checked.
+        """
+        complete = True
         for path in self._pathes:
             for name in names:
                 for ext in self._FILE_EXTS:
@@ -976,12 +1622,13 @@ class MCGAlbum:
                         urllib.request.quote(path),
                         urllib.request.quote('.'.join([name, ext]))
                     ])
-                    request = urllib.request.Request(url)
                     try:
-                        response = urllib.request.urlopen(request)
-                        return url
-                    except urllib.error.URLError as e:
-                        pass
+                        status, data = HTTPConnectionPool.get(url).request('HEAD', url)
+                        if status == 200:
+                            return url, True
+                    except Exception as e:
+                        complete = False
+        return None, complete
 
 
     def _find_cover_local(self, names):
@@ -1006,10 +1653,22 @@ class MCGAlbum:
 
 
 class MCGTrack:
-    def __init__(self, artists, title, file):
+    __slots__ = (
+        '_artists',
+        '_title',
+        '_file',
+        '_albumartists',
+        '_track',
+        '_length',
+        '_date',
+        '_last_modified'
+    )
+
+
+    def __init__(self, artists, title, file, shared_values=None):
         if type(artists) is not list:
             artists = [artists]
-        self._artists = artists
+        self._artists = MCGTrack.share(artists, shared_values)
         if type(title) is list:
             title = title[0]
         self._title = title
@@ -1017,10 +1676,11 @@ class MCGTrack:
             file = file[0]
         self._file = file
 
-        self._albumartists = []
+        self._albumartists = ()
         self._track = None
         self._length = 0
         self._date = None
+        self._last_modified = None
 
 
     def __eq__(self, other):
@@ -1033,10 +1693,10 @@ class MCGTrack:
         return self._artists
 
 
-    def set_albumartists(self, artists):
+    def set_albumartists(self, artists, shared_values=None):
         if type(artists) is not list:
             artists = [artists]
-        self._albumartists = artists
+        self._albumartists = MCGTrack.share(artists, shared_values)
 
 
     def get_albumartists(self):
@@ -1081,6 +1741,8 @@ class MCGTrack:
     def set_date(self, date):
         if type(date) is list:
             date = date[0]
+        if date is not None:
+            date = sys.intern(date)
         self._date = date
 
 
@@ -1088,20 +1750,39 @@ class MCGTrack:
         return self._file
 
 
+    def share(values, shared_values=None):
+        """Return a tuple of the given strings. If a dictionary of shared
+        values is given, the tuple is shared with all tracks using the
+        same dictionary and having the same values.
+        """
+        values = tuple([sys.intern(value) for value in values])
+        if shared_values is None:
+            return values
+        return shared_values.setdefault(values, values)
+
+
+    def get_last_modified(self):
+        return self._last_modified
+
+
+    def set_last_modified(self, last_modified):
+        if type(last_modified) is list:
+            last_modified = last_modified[0]
+        self._last_modified = last_modified
+
+
 
 
 class MCGPlaylistTrack(MCGTrack):
+    __slots__ = (
+        '_id',
+        '_pos'
+    )
+
+
     def __init__(self, track, id, pos):
-        MCGTrack.__init__(
-            self,
-            track.get_artists(),
-            track.get_title(),
-            track.get_file()
-        )
-        self.set_albumartists(track.get_albumartists())
-        self.set_track(track.get_track())
-        self.set_length(track.get_length())
-        self.set_date(track.get_date())
+        for name in MCGTrack.__slots__:
+            setattr(self, name, getattr(track, name))
         self._id = int(id)
         self._pos = int(pos)
 
@@ -1116,6 +1797,92 @@ class MCGPlaylistTrack(MCGTrack):
 
 
 
+class MCGSearchIndex:
+    """Index to filter albums with.
+
+    The filter values of each album are joined to one lowercase text. A
+    keyword matches an album if it is contained in the text, as with
+    MCGAlbum.filter(). To avoid scanning all texts, the albums are looked
+    up by the trigrams of the keyword first.
+    """
+    _NGRAM_LENGTH = 3
+    _SEPARATOR = '\n'
+
+
+    def __init__(self, albums=None):
+        self._texts = {}
+        self._ngrams = {}
+        self._lock = threading.Lock()
+        if albums:
+            for album in albums.values():
+                self.add(album)
+
+
+    def add(self, album):
+        hash = album.get_hash()
+        text = MCGSearchIndex._SEPARATOR.join(album.get_filter_values()).lower()
+        with self._lock:
+            self._remove(hash)
+            self._texts[hash] = text
+            for ngram in self._get_ngrams(text):
+                if ngram not in self._ngrams:
+                    self._ngrams[ngram] = set()
+                self._ngrams[ngram].add(hash)
+
+
+    def remove(self, hash):
+        with self._lock:
+            self._remove(hash)
+
+
+    def search(self, filter_string):
+        """Return the hashes of the albums matching all keywords of the
+        filter string or None if there are no keywords.
+        """
+        keywords = [keyword.lower() for keyword in filter_string.split(MCGAlbum._FILTER_DELIMITER) if keyword]
+        if not keywords:
+            return None
+        # Start with the longest keyword, it is the most selective one
+        keywords.sort(key=len, reverse=True)
+        with self._lock:
+            hashes = None
+            for keyword in keywords:
+                candidates = hashes
+                if len(keyword) >= MCGSearchIndex._NGRAM_LENGTH:
+                    for ngram in self._get_ngrams(keyword):
+                        ngram_hashes = self._ngrams.get(ngram, set())
+                        if candidates is None:
+                            candidates = ngram_hashes
+                        else:
+                            candidates = candidates & ngram_hashes
+                        if not candidates:
+                            return set()
+                if candidates is None:
+                    candidates = self._texts.keys()
+                hashes = set([hash for hash in candidates if keyword in self._texts[hash]])
+                if not hashes:
+                    break
+            return hashes
+
+
+    def _remove(self, hash):
+        if hash not in self._texts:
+            return
+        for ngram in self._get_ngrams(self._texts[hash]):
+            ngram_hashes = self._ngrams[ngram]
+            ngram_hashes.discard(hash)
+            if not ngram_hashes:
+                del self._ngrams[ngram]
+        del self._texts[hash]
+
+
+    def _get_ngrams(self, text):
+        length = MCGSearchIndex._NGRAM_LENGTH
+        return set([text[i:i+length] for i in range(len(text) - length + 1)])
+
+
+
+
 class MCGConfig(configparser.ConfigParser):
     CONFIG_DIR = '~/.config/mcg/'
 
@@ -1145,8 +1912,22 @@ class MCGConfig(configparser.ConfigParser):
 
 
 class MCGCache():
+    """Cache for the thumbnails of albums.
+
+    Thumbnails are stored once by the hash of their content in a store
+    shared by all hosts. Each host has an index mapping albums and sizes to
+    the stored thumbnails.
+    """
     DIRNAME = '~/.cache/mcg/'
+    STORE_DIRNAME = '.store'
     SIZE_FILENAME = 'size'
+    INDEX_FILENAME = 'index'
+    THUMBNAILS_FILENAME = 'thumbnails'
+    LIBRARY_FILENAME = 'library'
+    COVERS_FILENAME = 'covers'
+    MAX_BYTES = 1024 * 1024 * 1024
+    MAX_ENTRIES = 20000
+    UNREFERENCED_TTL = 24 * 60 * 60
     _lock = threading.Lock()
 
 
@@ -1154,37 +1935,449 @@ class MCGCache():
         self._host = host
         self._size = size
         self._dirname = os.path.expanduser(os.path.join(MCGCache.DIRNAME, host))
-        if not os.path.exists(self._dirname):
-            os.makedirs(self._dirname)
-        self._read_size()
+        self._store_dirname = os.path.expanduser(os.path.join(MCGCache.DIRNAME, MCGCache.STORE_DIRNAME))
+        self._thumbnails = {}
+        self._thumbnails_lock = threading.Lock()
+        self._added = {}
+        self._accessed = {}
+        self._removed = set()
+        for dirname in [self._dirname, self._store_dirname]:
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+        MCGCache._lock.acquire()
+        try:
+            self._migrate()
+            self._thumbnails = self._read_thumbnails(self._dirname)
+        finally:
+            MCGCache._lock.release()
 
 
-    def create_filename(self, album):
-        return os.path.join(self._dirname, '-'.join([album.get_hash()]))
+    def get_filename(self, album, size=None):
+        """Return the filename of the cached thumbnail of the album or
+        None.
+        """
+        if size is None:
+            size = self._size
+        with self._thumbnails_lock:
+            content = self._thumbnails.get(album.get_hash(), {}).get(size)
+        if content is None:
+            return None
+        filename = os.path.join(self._store_dirname, content)
+        if not os.path.isfile(filename):
+            return None
+        return filename
 
 
-    def _read_size(self):
-        size = 100
+    def get_larger_filename(self, album):
+        """Return the filename of the smallest cached thumbnail of the
+        album that is larger than the current size or None.
+        """
+        with self._thumbnails_lock:
+            sizes = [size for size in self._thumbnails.get(album.get_hash(), {}).keys() if size > self._size]
+        for size in sorted(sizes):
+            filename = self.get_filename(album, size)
+            if filename is not None:
+                return filename
+        return None
+
+
+    def store(self, album, data):
+        """Store the thumbnail data of the album for the current size and
+        return its filename.
+        """
+        content, filename = self._write_store(data)
+        with self._thumbnails_lock:
+            self._thumbnails.setdefault(album.get_hash(), {})[self._size] = content
+            self._added[(album.get_hash(), self._size)] = content
+            self._removed.discard(album.get_hash())
+        self.touch(album)
+        return filename
+
+
+    def touch(self, album):
+        """Mark the thumbnail of the current size as used."""
+        with self._thumbnails_lock:
+            content = self._thumbnails.get(album.get_hash(), {}).get(self._size)
+            if content is not None:
+                self._accessed[content] = time.time()
+
+
+    def retain(self, hashes):
+        """Forget the thumbnails of all albums not in the given hashes."""
+        hashes = set(hashes)
+        with self._thumbnails_lock:
+            unused = [hash for hash in self._thumbnails.keys() if hash not in hashes]
+            for hash in unused:
+                del self._thumbnails[hash]
+                self._removed.add(hash)
+
+
+    def commit(self):
+        """Update the index of the host and the access times of the store
+        and evict the least recently used thumbnails if the store exceeds
+        its size or entry budget.
+        """
         MCGCache._lock.acquire()
-        # Read old size
-        filename = os.path.join(self._dirname, MCGCache.SIZE_FILENAME)
-        if os.path.exists(filename):
+        try:
+            with self._thumbnails_lock:
+                added = self._added
+                accessed = self._accessed
+                removed = self._removed
+                self._added = {}
+                self._accessed = {}
+                self._removed = set()
+
+            # Update index of host
+            thumbnails = self._read_thumbnails(self._dirname)
+            for hash in removed:
+                if hash in thumbnails:
+                    del thumbnails[hash]
+            for (hash, size), content in added.items():
+                thumbnails.setdefault(hash, {})[size] = content
+
+            # Reconcile access times with stored thumbnails
+            index = self._read_index()
+            entries = {}
+            for filename in os.listdir(self._store_dirname):
+                if not self._is_thumbnail(filename):
+                    continue
+                path = os.path.join(self._store_dirname, filename)
+                if filename in index and filename not in accessed:
+                    entries[filename] = index[filename]
+                else:
+                    entries[filename] = [
+                        os.path.getsize(path),
+                        accessed.get(filename, os.path.getmtime(path))
+                    ]
+
+            # Evict thumbnails no host refers to anymore
+            referenced = self._get_referenced(thumbnails)
+            now = time.time()
+            for filename in list(entries.keys()):
+                if filename not in referenced and now - entries[filename][1] > MCGCache.UNREFERENCED_TTL:
+                    del entries[filename]
+                    self._remove(filename)
+
+            # Evict least recently used thumbnails
+            total = sum(entry[0] for entry in entries.values())
+            for filename in sorted(entries.keys(), key=lambda filename: entries[filename][1]):
+                if total <= MCGCache.MAX_BYTES and len(entries) <= MCGCache.MAX_ENTRIES:
+                    break
+                total = total - entries[filename][0]
+                del entries[filename]
+                self._remove(filename)
+            for hash in list(thumbnails.keys()):
+                thumbnails[hash] = {size: content for size, content in thumbnails[hash].items() if content in entries}
+                if not thumbnails[hash]:
+                    del thumbnails[hash]
+
+            self._write_thumbnails(self._dirname, thumbnails)
+            self._write_index(entries)
+            with self._thumbnails_lock:
+                for (hash, size), content in self._added.items():
+                    thumbnails.setdefault(hash, {})[size] = content
+                self._thumbnails = thumbnails
+        except Exception as e:
+            print("commit:", e)
+        finally:
+            MCGCache._lock.release()
+
+
+    def _get_referenced(self, thumbnails):
+        """Return the thumbnails referenced by any host."""
+        referenced = set()
+        for host in os.listdir(os.path.expanduser(MCGCache.DIRNAME)):
+            dirname = os.path.expanduser(os.path.join(MCGCache.DIRNAME, host))
+            if host == MCGCache.STORE_DIRNAME or not os.path.isdir(dirname):
+                continue
+            if dirname == self._dirname:
+                host_thumbnails = thumbnails
+            else:
+                host_thumbnails = self._read_thumbnails(dirname)
+            for sizes in host_thumbnails.values():
+                referenced.update(sizes.values())
+        return referenced
+
+
+    def _is_thumbnail(self, filename):
+        return len(filename) == 32 and all(c in '0123456789abcdef' for c in filename)
+
+
+    def _write_store(self, data):
+        content = md5(data).hexdigest()
+        filename = os.path.join(self._store_dirname, content)
+        if not os.path.exists(filename):
+            tmp_filename = '.'.join([filename, str(threading.get_ident()), 'tmp'])
+            with open(tmp_filename, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_filename, filename)
+        return content, filename
+
+
+    def _remove(self, filename):
+        try:
+            os.unlink(os.path.join(self._store_dirname, filename))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print("remove:", e)
+
+
+    def _read_thumbnails(self, dirname):
+        filename = os.path.join(dirname, MCGCache.THUMBNAILS_FILENAME)
+        if not os.path.isfile(filename):
+            return {}
+        try:
             with open(filename, 'r') as f:
-                size = int(f.readline())
-        # Clear cache if size has changed
-        if size != self._size:
-            self._clear()
-        # Write new size
-        with open(filename, 'w') as f:
-            f.write(str(self._size))
-        MCGCache._lock.release()
+                thumbnails = json.load(f)
+        except Exception as e:
+            print("thumbnails:", e)
+            return {}
+        return {
+            hash: {int(size): content for size, content in sizes.items()}
+            for hash, sizes in thumbnails.items()
+        }
 
 
-    def _clear(self):
+    def _write_thumbnails(self, dirname, thumbnails):
+        filename = os.path.join(dirname, MCGCache.THUMBNAILS_FILENAME)
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(thumbnails, f)
+        os.replace(filename + '.tmp', filename)
+
+
+    def _read_index(self):
+        filename = os.path.join(self._store_dirname, MCGCache.INDEX_FILENAME)
+        if not os.path.isfile(filename):
+            return {}
+        try:
+            with open(filename, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print("index:", e)
+            return {}
+
+
+    def _write_index(self, entries):
+        filename = os.path.join(self._store_dirname, MCGCache.INDEX_FILENAME)
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(entries, f)
+        os.replace(filename + '.tmp', filename)
+
+
+    def _migrate(self):
+        """Move thumbnails of former layouts of the host directory into
+        the shared store.
+        """
+        # Size of the single-size layout
+        legacy_size = None
+        filename = os.path.join(self._dirname, MCGCache.SIZE_FILENAME)
+        if os.path.exists(filename):
+            legacy_size = 100
+            try:
+                with open(filename, 'r') as f:
+                    legacy_size = int(f.readline())
+            except Exception as e:
+                print("migrate:", e)
+            os.unlink(filename)
+        filename = os.path.join(self._dirname, MCGCache.INDEX_FILENAME)
+        if os.path.exists(filename):
+            os.unlink(filename)
+
+        thumbnails = None
         for filename in os.listdir(self._dirname):
+            parts = filename.split('-')
+            if len(parts) == 2 and len(parts[0]) == 32 and parts[1].isdigit():
+                hash, size = parts[0], int(parts[1])
+            elif len(filename) == 32 and legacy_size is not None:
+                hash, size = filename, legacy_size
+            else:
+                continue
             path = os.path.join(self._dirname, filename)
-            if os.path.isfile(path):
-                try:
-                    os.unlink(path)
-                except Exception as e:
-                    print("clear:", e)
+            try:
+                with open(path, 'rb') as f:
+                    content, store_filename = self._write_store(f.read())
+                os.unlink(path)
+            except Exception as e:
+                print("migrate:", e)
+                continue
+            if thumbnails is None:
+                thumbnails = self._read_thumbnails(self._dirname)
+            thumbnails.setdefault(hash, {})[size] = content
+        if thumbnails is not None:
+            self._write_thumbnails(self._dirname, thumbnails)
+
+
+
+
+class MCGLibraryCache():
+    """Snapshot of the album model of a host.
+
+    The snapshot is stored together with the database timestamp of MPD so
+    that it can be reused as long as the database has not been changed.
+    """
+    VERSION = 7
+
+
+    def __init__(self, host):
+        self._dirname = os.path.expanduser(os.path.join(MCGCache.DIRNAME, host))
+        self._filename = os.path.join(self._dirname, MCGCache.LIBRARY_FILENAME)
+        self._logger = logging.getLogger(__name__)
+
+
+    def load(self, db_update, image_dir):
+        """Return the stored albums if they match the given database
+        timestamp and image directory or None otherwise.
+        """
+        if db_update is None or not os.path.isfile(self._filename):
+            return None
+        try:
+            with open(self._filename, 'rb') as f:
+                version, snapshot_db_update, snapshot_image_dir, albums = pickle.load(f)
+        except Exception as e:
+            self._logger.warning("failed to read library snapshot: %s", e)
+            return None
+        if version != MCGLibraryCache.VERSION:
+            return None
+        if snapshot_db_update != db_update or snapshot_image_dir != image_dir:
+            return None
+        return albums
+
+
+    def save(self, db_update, image_dir, albums):
+        """Store the albums together with the database timestamp."""
+        if db_update is None:
+            return
+        if not os.path.exists(self._dirname):
+            os.makedirs(self._dirname)
+        filename = self._filename + '.tmp'
+        try:
+            with open(filename, 'wb') as f:
+                pickle.dump(
+                    (MCGLibraryCache.VERSION, db_update, image_dir, albums),
+                    f,
+                    pickle.HIGHEST_PROTOCOL
+                )
+            os.replace(filename, self._filename)
+        except Exception as e:
+            self._logger.warning("failed to write library snapshot: %s", e)
+
+
+
+
+class MCGCoverIndex():
+    """Persistent index of the cover locations of the albums of a host.
+
+    Both found cover URLs and albums without cover are stored, so that the
+    cover search is only repeated after the entry has expired.
+    """
+    TTL = 7 * 24 * 60 * 60
+    TTL_MISSING = 24 * 60 * 60
+    _SAVE_INTERVAL = 5
+    _indices = {}
+    _lock = threading.Lock()
+
+
+    def get(host, image_dir):
+        """Return the cover index for the given host and image directory."""
+        with MCGCoverIndex._lock:
+            if not MCGCoverIndex._indices:
+                atexit.register(MCGCoverIndex.save_all)
+            key = (host, image_dir)
+            if key not in MCGCoverIndex._indices:
+                MCGCoverIndex._indices[key] = MCGCoverIndex(host, image_dir)
+            return MCGCoverIndex._indices[key]
+
+
+    def save_all():
+        """Save all cover indices with unsaved changes."""
+        with MCGCoverIndex._lock:
+            indices = list(MCGCoverIndex._indices.values())
+        for index in indices:
+            index.save()
+
+
+    def __init__(self, host, image_dir):
+        self._logger = logging.getLogger(__name__)
+        self._image_dir = image_dir
+        self._dirname = os.path.expanduser(os.path.join(MCGCache.DIRNAME, host))
+        self._filename = os.path.join(self._dirname, MCGCache.COVERS_FILENAME)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._saved = time.time()
+        self._load()
+
+
+    def lookup(self, hash):
+        """Return a tuple whether a valid entry exists for the album and
+        the cover URL (None if the album has no cover).
+        """
+        with self._lock:
+            if hash not in self._entries:
+                return False, None
+            url, timestamp = self._entries[hash]
+        ttl = MCGCoverIndex.TTL if url is not None else MCGCoverIndex.TTL_MISSING
+        if time.time() - timestamp > ttl:
+            return False, None
+        return True, url
+
+
+    def set(self, hash, url):
+        """Store the cover URL (or None) of an album."""
+        with self._lock:
+            self._entries[hash] = (url, time.time())
+            self._dirty = True
+        if time.time() - self._saved > MCGCoverIndex._SAVE_INTERVAL:
+            self.save()
+
+
+    def remove(self, hash):
+        """Remove the entry of an album."""
+        with self._lock:
+            if hash not in self._entries:
+                return
+            del self._entries[hash]
+            self._dirty = True
+
+
+    def save(self):
+        # Saves are serialized so that an older snapshot cannot replace a
+        # newer one
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = {
+                    'image_dir': self._image_dir,
+                    'entries': dict(self._entries)
+                }
+                self._dirty = False
+                self._saved = time.time()
+            try:
+                if not os.path.exists(self._dirname):
+                    os.makedirs(self._dirname)
+                filename = self._filename + '.tmp'
+                with open(filename, 'w') as f:
+                    json.dump(data, f)
+                os.replace(filename, self._filename)
+            except Exception as e:
+                self._logger.warning("failed to write cover index: %s", e)
+                with self._lock:
+                    self._dirty = True
+
+
+    def _load(self):
+        if not os.path.isfile(self._filename):
+            return
+        try:
+            with open(self._filename, 'r') as f:
+                data = json.load(f)
+        except Exception as e:
+            self._logger.warning("failed to read cover index: %s", e)
+            return
+        if data.get('image_dir') != self._image_dir:
+            return
+        for hash, entry in data.get('entries', {}).items():
+            self._entries[hash] = tuple(entry)
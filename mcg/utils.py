@@ -3,19 +3,40 @@
 
 import gi
 gi.require_version('Gtk', '3.0')
+import collections
+import concurrent.futures
+import http.client
 import locale
-import os
-import urllib
+import mmap
+import struct
+import threading
+import urllib.parse
 
-from gi.repository import GdkPixbuf
+from gi.repository import Gtk, GdkPixbuf, GLib
 
 
 
 
 class Utils:
+    ALBUMART_SCHEME = 'mpd:'
+    # Header of raw thumbnails: magic, width, height, rowstride, alpha
+    _RAW_HEADER = struct.Struct('<4sIIIB')
+    _RAW_MAGIC = b'MCGR'
+    _albumart_provider = None
+
+
+    def set_albumart_provider(provider):
+        """Set the function to load album art from MPD with. The function
+        gets the file of a track and returns the image data or None.
+        """
+        Utils._albumart_provider = provider
+
+
     def load_cover(url):
         if not url:
             return None
+        if url.startswith(Utils.ALBUMART_SCHEME):
+            return Utils._load_cover_albumart(url[len(Utils.ALBUMART_SCHEME):])
         if url.startswith('/'):
             try:
                 return GdkPixbuf.Pixbuf.new_from_file(url)
@@ -24,9 +45,11 @@ class Utils:
                 return None
         else:
             try:
-                response = urllib.request.urlopen(url)
+                status, data = HTTPConnectionPool.get(url).request('GET', url)
+                if status != 200:
+                    return None
                 loader = GdkPixbuf.PixbufLoader()
-                loader.write(response.read())
+                loader.write(data)
                 loader.close()
                 return loader.get_pixbuf()
             except Exception as e:
@@ -34,27 +57,84 @@ class Utils:
                 return None
 
 
+    def _load_cover_albumart(file):
+        if Utils._albumart_provider is None:
+            return None
+        try:
+            data = Utils._albumart_provider(file)
+            if not data:
+                return None
+            loader = GdkPixbuf.PixbufLoader()
+            loader.write(data)
+            loader.close()
+            return loader.get_pixbuf()
+        except Exception as e:
+            print(e)
+            return None
+
+
     def load_thumbnail(cache, album, size):
-        cache_url = cache.create_filename(album)
+        cache_url = cache.get_filename(album)
         pixbuf = None
 
-        if os.path.isfile(cache_url):
-            try:
-                pixbuf = GdkPixbuf.Pixbuf.new_from_file(cache_url)
-            except Exception as e:
-                print(e)
+        if cache_url is not None:
+            pixbuf = Utils._load_raw_thumbnail(cache_url)
+            if pixbuf is not None:
+                cache.touch(album)
         else:
-            url = album.get_cover()
-            pixbuf = Utils.load_cover(url)
+            # Downscale a larger cached thumbnail or load the cover
+            url = cache.get_larger_filename(album)
+            if url is not None:
+                pixbuf = Utils._load_raw_thumbnail(url)
+            else:
+                url = album.get_cover()
+                pixbuf = Utils.load_cover(url)
+                if pixbuf is None and url and not url.startswith(Utils.ALBUMART_SCHEME):
+                    album.forget_cover()
             if pixbuf is not None:
                 pixbuf = pixbuf.scale_simple(size, size, GdkPixbuf.InterpType.HYPER)
-                filetype = os.path.splitext(url)[1][1:]
-                if filetype == 'jpg':
-                    filetype = 'jpeg'
-                pixbuf.savev(cache.create_filename(album), filetype, [], [])
+                cache.store(album, Utils._create_raw_thumbnail(pixbuf))
         return pixbuf
 
 
+    def _create_raw_thumbnail(pixbuf):
+        """Return the pixel data of a pixbuf prefixed with a header."""
+        header = Utils._RAW_HEADER.pack(
+            Utils._RAW_MAGIC,
+            pixbuf.get_width(),
+            pixbuf.get_height(),
+            pixbuf.get_rowstride(),
+            pixbuf.get_has_alpha()
+        )
+        return header + pixbuf.read_pixel_bytes().get_data()
+
+
+    def _load_raw_thumbnail(filename):
+        """Load a thumbnail stored as raw pixel data. Thumbnails in other
+        formats are decoded as images.
+        """
+        try:
+            with open(filename, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    if data[:len(Utils._RAW_MAGIC)] != Utils._RAW_MAGIC:
+                        return GdkPixbuf.Pixbuf.new_from_file(filename)
+                    magic, width, height, rowstride, has_alpha = Utils._RAW_HEADER.unpack_from(data)
+                    # Copy the pixels once from the mapping
+                    pixels = data[Utils._RAW_HEADER.size:]
+            return GdkPixbuf.Pixbuf.new_from_bytes(
+                GLib.Bytes.new(pixels),
+                GdkPixbuf.Colorspace.RGB,
+                bool(has_alpha),
+                8,
+                width,
+                height,
+                rowstride
+            )
+        except Exception as e:
+            print(e)
+            return None
+
+
     def create_artists_label(album):
         label = ', '.join(album.get_albumartists())
         if album.get_artists():
@@ -77,6 +157,236 @@ class Utils:
 
 
 
+class HTTPConnectionPool:
+    """Pool of persistent (keep-alive) HTTP connections to one server."""
+    SIZE = 4
+    TIMEOUT = 10
+    MAX_REDIRECTS = 5
+    REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+    _pools = {}
+    _lock = threading.Lock()
+
+
+    def get(url):
+        """Return the connection pool for the server of the given URL."""
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        with HTTPConnectionPool._lock:
+            if key not in HTTPConnectionPool._pools:
+                HTTPConnectionPool._pools[key] = HTTPConnectionPool(
+                    parts.scheme,
+                    parts.netloc,
+                    HTTPConnectionPool.SIZE,
+                    HTTPConnectionPool.TIMEOUT
+                )
+            return HTTPConnectionPool._pools[key]
+
+
+    def configure(size, timeout=None):
+        """Set the number of concurrent connections and the timeout (in
+        seconds) per server. Existing pools are closed.
+        """
+        with HTTPConnectionPool._lock:
+            HTTPConnectionPool.SIZE = max(size, 1)
+            if timeout is not None:
+                HTTPConnectionPool.TIMEOUT = timeout
+            pools = list(HTTPConnectionPool._pools.values())
+            HTTPConnectionPool._pools.clear()
+        for pool in pools:
+            pool.close()
+
+
+    def __init__(self, scheme, netloc, size, timeout):
+        self._scheme = scheme
+        self._netloc = netloc
+        self._timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(size)
+        self._connections = []
+        self._lock = threading.Lock()
+
+
+    def request(self, method, url, redirects=None):
+        """Perform a request and return the status and the body of the
+        response. Redirects are followed up to the given number of times.
+        """
+        if redirects is None:
+            redirects = HTTPConnectionPool.MAX_REDIRECTS
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path = '?'.join([path, parts.query])
+        with self._semaphore:
+            connection = self._acquire()
+            try:
+                try:
+                    status, location, data = self._request(connection, method, path)
+                except (http.client.HTTPException, OSError):
+                    # The server might have closed the idle connection
+                    connection.close()
+                    connection = self._create()
+                    status, location, data = self._request(connection, method, path)
+            except Exception:
+                connection.close()
+                raise
+            self._release(connection)
+        if status in HTTPConnectionPool.REDIRECT_STATUSES and location:
+            if redirects <= 0:
+                raise http.client.HTTPException("too many redirects: {}".format(url))
+            url = urllib.parse.urljoin(url, location)
+            return HTTPConnectionPool.get(url).request(method, url, redirects - 1)
+        return status, data
+
+
+    def close(self):
+        with self._lock:
+            connections = self._connections
+            self._connections = []
+        for connection in connections:
+            connection.close()
+
+
+    def _request(self, connection, method, path):
+        connection.request(method, path)
+        response = connection.getresponse()
+        data = response.read()
+        return response.status, response.getheader('Location'), data
+
+
+    def _acquire(self):
+        with self._lock:
+            if self._connections:
+                return self._connections.pop()
+        return self._create()
+
+
+    def _release(self, connection):
+        with self._lock:
+            self._connections.append(connection)
+
+
+    def _create(self):
+        if self._scheme == 'https':
+            return http.client.HTTPSConnection(self._netloc, timeout=self._timeout)
+        return http.client.HTTPConnection(self._netloc, timeout=self._timeout)
+
+
+
+
+class IconCache:
+    """Share the pixbufs of themed icons by name and size instead of
+    rendering an icon again for every use.
+    """
+    _pixbufs = {}
+    _lock = threading.Lock()
+    _theme = None
+
+
+    def load(name, size):
+        key = (name, size)
+        with IconCache._lock:
+            if IconCache._theme is None:
+                IconCache._theme = Gtk.IconTheme.get_default()
+                IconCache._theme.connect('changed', IconCache._on_theme_changed)
+            pixbuf = IconCache._pixbufs.get(key)
+            if pixbuf is None:
+                pixbuf = IconCache._theme.load_icon(
+                    name,
+                    size,
+                    Gtk.IconLookupFlags.FORCE_SVG & Gtk.IconLookupFlags.FORCE_SIZE
+                )
+                IconCache._pixbufs[key] = pixbuf
+            return pixbuf
+
+
+    def _on_theme_changed(theme):
+        with IconCache._lock:
+            IconCache._pixbufs = {}
+
+
+
+
+class ThumbnailLoader:
+    """Load the thumbnails of albums concurrently with a bounded pool of
+    worker threads.
+    """
+
+
+    def __init__(self, cache, size, workers, stop):
+        self._cache = cache
+        self._size = size
+        self._workers = max(workers, 1)
+        self._stop = stop
+
+
+    def load(self, albums, ordered=False):
+        """Yield tuples of album and thumbnail (or None) as soon as they
+        are loaded. If ordered is set, the albums are yielded in the given
+        order. Loading is cancelled when the stop event is set.
+        """
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._workers,
+            thread_name_prefix='mcg-thumbnail'
+        )
+        try:
+            futures = [executor.submit(self._load, album) for album in albums]
+            if not ordered:
+                futures = concurrent.futures.as_completed(futures)
+            for future in futures:
+                if self._stop.is_set():
+                    return
+                yield future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def load_prioritized(self, albums, priority):
+        """Yield tuples of album and thumbnail (or None) as soon as they
+        are loaded. Whenever a worker is free, the next album is taken from
+        the hashes returned by the priority function and in the given order
+        if none of them is pending. Loading is cancelled when the stop event
+        is set.
+        """
+        pending = collections.OrderedDict((album.get_hash(), album) for album in albums)
+        running = set()
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._workers,
+            thread_name_prefix='mcg-thumbnail'
+        )
+        try:
+            while pending or running:
+                while pending and len(running) < self._workers:
+                    album = None
+                    for hash in priority():
+                        if hash in pending:
+                            album = pending.pop(hash)
+                            break
+                    if album is None:
+                        hash, album = pending.popitem(last=False)
+                    running.add(executor.submit(self._load, album))
+                done, running = concurrent.futures.wait(
+                    running,
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    if self._stop.is_set():
+                        return
+                    yield future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def _load(self, album):
+        pixbuf = None
+        if not self._stop.is_set():
+            try:
+                pixbuf = Utils.load_thumbnail(self._cache, album, self._size)
+            except Exception as e:
+                print(e)
+        return album, pixbuf
+
+
+
+
 class TracklistSize:
     LARGE = 0
     SMALL = 1
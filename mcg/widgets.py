@@ -12,11 +12,15 @@ import logging
 import math
 import sys
 import threading
+import time
 
 from gi.repository import Gtk, Gdk, GObject, GdkPixbuf, GLib, Gio
 
 from mcg import client
+from mcg.utils import HTTPConnectionPool
+from mcg.utils import IconCache
 from mcg.utils import SortOrder
+from mcg.utils import ThumbnailLoader
 from mcg.utils import TracklistSize
 from mcg.utils import Utils
 from mcg.zeroconf import ZeroconfProvider
@@ -87,6 +91,8 @@ class Window():
     SETTING_ITEM_SIZE = 'item-size'
     SETTING_SORT_ORDER = 'sort-order'
     SETTING_SORT_TYPE = 'sort-type'
+    SETTING_THUMBNAIL_WORKERS = 'thumbnail-workers'
+    SETTING_BULK_CONNECTIONS = 'bulk-connections'
     STOCK_ICON_DEFAULT = 'image-x-generic-symbolic'
     _PANEL_INDEX_SERVER = 0
     _PANEL_INDEX_COVER = 1
@@ -103,6 +109,7 @@ class Window():
         self._panels = []
         self._mcg = client.Client()    
         self._logger = logging.getLogger(__name__)
+        Utils.set_albumart_provider(self._mcg.get_albumart)
         self._size = self._settings.get_value(Window.SETTING_WINDOW_SIZE)
         self._maximized = self._settings.get_boolean(Window.SETTING_WINDOW_MAXIMIZED)
         self._fullscreened = False
@@ -138,6 +145,10 @@ class Window():
         self._panels[Window._PANEL_INDEX_LIBRARY].set_item_size(self._settings.get_int(Window.SETTING_ITEM_SIZE))
         self._panels[Window._PANEL_INDEX_LIBRARY].set_sort_order(self._settings.get_enum(Window.SETTING_SORT_ORDER))
         self._panels[Window._PANEL_INDEX_LIBRARY].set_sort_type(self._settings.get_boolean(Window.SETTING_SORT_TYPE))
+        self._panels[Window._PANEL_INDEX_PLAYLIST].set_thumbnail_workers(self._settings.get_int(Window.SETTING_THUMBNAIL_WORKERS))
+        self._panels[Window._PANEL_INDEX_LIBRARY].set_thumbnail_workers(self._settings.get_int(Window.SETTING_THUMBNAIL_WORKERS))
+        HTTPConnectionPool.configure(self._settings.get_int(Window.SETTING_THUMBNAIL_WORKERS))
+        self._mcg.set_bulk_connections(self._settings.get_int(Window.SETTING_BULK_CONNECTIONS))
 
         # Signals
         self._header_bar.connect('stack-switched', self.on_header_bar_stack_switched)
@@ -164,13 +175,17 @@ class Window():
         self._mcg.connect_signal(client.Client.SIGNAL_STATS, self.on_mcg_stats)
         self._mcg.connect_signal(client.Client.SIGNAL_LOAD_OUTPUT_DEVICES, self.on_mcg_load_output_devices)
         self._mcg.connect_signal(client.Client.SIGNAL_LOAD_PLAYLIST, self.on_mcg_load_playlist)
+        self._mcg.connect_signal(client.Client.SIGNAL_UPDATE_PLAYLIST, self.on_mcg_update_playlist)
         self._mcg.connect_signal(client.Client.SIGNAL_LOAD_ALBUMS, self.on_mcg_load_albums)
+        self._mcg.connect_signal(client.Client.SIGNAL_REFRESH_ALBUMS, self.on_mcg_refresh_albums)
         self._mcg.connect_signal(client.Client.SIGNAL_ERROR, self.on_mcg_error)
         self._settings.connect('changed::'+Window.SETTING_PANEL, self.on_settings_panel_changed)
         self._settings.connect('changed::'+Window.SETTING_TRACKLIST_SIZE, self.on_settings_tracklist_size_changed)
         self._settings.connect('changed::'+Window.SETTING_ITEM_SIZE, self.on_settings_item_size_changed)
         self._settings.connect('changed::'+Window.SETTING_SORT_ORDER, self.on_settings_sort_order_changed)
         self._settings.connect('changed::'+Window.SETTING_SORT_TYPE, self.on_settings_sort_type_changed)
+        self._settings.connect('changed::'+Window.SETTING_THUMBNAIL_WORKERS, self.on_settings_thumbnail_workers_changed)
+        self._settings.connect('changed::'+Window.SETTING_BULK_CONNECTIONS, self.on_settings_bulk_connections_changed)
         handlers = {
             'on_appwindow_size_allocate': self.on_resize,
             'on_appwindow_window_state_event': self.on_state,
@@ -407,10 +422,18 @@ class Window():
         self._panels[self._PANEL_INDEX_PLAYLIST].set_playlist(self._connection_panel.get_host(), playlist)
 
 
+    def on_mcg_update_playlist(self, playlist, start, removed, added):
+        self._panels[self._PANEL_INDEX_PLAYLIST].update_playlist(self._connection_panel.get_host(), playlist, start, removed, added)
+
+
     def on_mcg_load_albums(self, albums):
         self._panels[self._PANEL_INDEX_LIBRARY].set_albums(self._connection_panel.get_host(), albums)
 
 
+    def on_mcg_refresh_albums(self, albums, added, removed, changed):
+        self._panels[self._PANEL_INDEX_LIBRARY].refresh_albums(self._connection_panel.get_host(), albums, added, removed, changed)
+
+
     def on_mcg_error(self, error):
         GObject.idle_add(self._show_error, str(error))
 
@@ -443,6 +466,17 @@ class Window():
         self._panels[Window._PANEL_INDEX_LIBRARY].set_sort_type(sort_type)
 
 
+    def on_settings_thumbnail_workers_changed(self, settings, key):
+        workers = settings.get_int(key)
+        self._panels[Window._PANEL_INDEX_PLAYLIST].set_thumbnail_workers(workers)
+        self._panels[Window._PANEL_INDEX_LIBRARY].set_thumbnail_workers(workers)
+        HTTPConnectionPool.configure(workers)
+
+
+    def on_settings_bulk_connections_changed(self, settings, key):
+        self._mcg.set_bulk_connections(settings.get_int(key))
+
+
     # Private methods
 
     def _connect(self):
@@ -940,7 +974,6 @@ class CoverPanel(GObject.GObject):
         self._timer = None
         self._properties = {}
         self._tracklist_size = TracklistSize.LARGE
-        self._icon_theme = Gtk.IconTheme.get_default()
         self._fullscreened = False
 
         # Widgets
@@ -1057,7 +1090,7 @@ class CoverPanel(GObject.GObject):
             )
             self._album_date_label.set_markup(
                 GObject.markup_escape_text(
-                    ', '.join(album.get_dates())
+                    album.get_dates_label()
                 )
             )
             self._album_artist_label.set_markup(
@@ -1127,6 +1160,8 @@ class CoverPanel(GObject.GObject):
             if url and url is not "":
                 # Load image and draw it
                 self._cover_pixbuf = Utils.load_cover(url)
+                if self._cover_pixbuf is None and not url.startswith(Utils.ALBUMART_SCHEME):
+                    new_album.forget_cover()
             else:
                 # Reset image
                 self._cover_pixbuf = self._get_default_image()
@@ -1222,11 +1257,7 @@ class CoverPanel(GObject.GObject):
 
 
     def _get_default_image(self):
-        return self._icon_theme.load_icon(
-            Window.STOCK_ICON_DEFAULT,
-            512,
-            Gtk.IconLookupFlags.FORCE_SVG & Gtk.IconLookupFlags.FORCE_SIZE
-        )
+        return IconCache.load(Window.STOCK_ICON_DEFAULT, 512)
 
 
 
@@ -1244,11 +1275,11 @@ class PlaylistPanel(GObject.GObject):
         GObject.GObject.__init__(self)
         self._host = None
         self._item_size = 150
+        self._thumbnail_workers = 4
         self._playlist = None
         self._playlist_albums = None
         self._playlist_lock = threading.Lock()
         self._playlist_stop = threading.Event()
-        self._icon_theme = Gtk.IconTheme.get_default()
         self._standalone_pixbuf = None
         self._selected_albums = []
 
@@ -1401,12 +1432,21 @@ class PlaylistPanel(GObject.GObject):
         return self._item_size
 
 
+    def set_thumbnail_workers(self, workers):
+        self._thumbnail_workers = workers
+
+
     def set_playlist(self, host, playlist):
         self._host = host
         self._playlist_stop.set()
         threading.Thread(target=self._set_playlist, args=(host, playlist, self._item_size,)).start()
 
 
+    def update_playlist(self, host, playlist, start, removed, added):
+        self._host = host
+        threading.Thread(target=self._update_playlist, args=(host, playlist, start, removed, added, self._item_size,)).start()
+
+
     def stop_threads(self):
         self._playlist_stop.set()
 
@@ -1424,33 +1464,16 @@ class PlaylistPanel(GObject.GObject):
         GObject.idle_add(self._playlist_grid.set_item_padding, size / 100)
 
         cache = client.MCGCache(host, size)
-        for album in playlist:
-            pixbuf = None
-            if album.get_cover() is not None:
-                try:
-                    pixbuf = Utils.load_thumbnail(cache, album, size)
-                except Exception as e:
-                    print(e)
+        loader = ThumbnailLoader(cache, size, self._thumbnail_workers, self._playlist_stop)
+        for album, pixbuf in loader.load(playlist, True):
             if pixbuf is None:
-                pixbuf = self._icon_theme.load_icon(
-                    Window.STOCK_ICON_DEFAULT,
-                    self._item_size,
-                    Gtk.IconLookupFlags.FORCE_SVG & Gtk.IconLookupFlags.FORCE_SIZE
-                )
+                pixbuf = IconCache.load(Window.STOCK_ICON_DEFAULT, self._item_size)
             if pixbuf is not None:
-                self._playlist_grid_model.append([
-                    pixbuf,
-                    GObject.markup_escape_text("\n".join([
-                        album.get_title(),
-                        ', '.join(album.get_dates()),
-                        Utils.create_artists_label(album)
-                    ])),
-                    album.get_hash()
-                ])
-
-            if self._playlist_stop.is_set():
-                self._playlist_lock.release()
-                return
+                self._playlist_grid_model.append(self._create_row(album, pixbuf))
+        cache.commit()
+        if self._playlist_stop.is_set():
+            self._playlist_lock.release()
+            return
 
         self._playlist_grid.set_model(self._playlist_grid_model)
         self._playlist_grid.thaw_child_notify()
@@ -1459,6 +1482,54 @@ class PlaylistPanel(GObject.GObject):
         self._playlist_lock.release()
 
 
+    def _update_playlist(self, host, playlist, start, removed, added, size):
+        self._playlist_lock.acquire()
+        previous = self._playlist
+        if previous is None or len(previous) - removed + len(added) != len(playlist) or self._playlist_stop.is_set():
+            # The changes do not apply to the shown playlist
+            self._playlist_lock.release()
+            self.set_playlist(host, playlist)
+            return
+        self._playlist = playlist
+        self._playlist_albums = {}
+        for album in playlist:
+            self._playlist_albums[album.get_hash()] = album
+
+        rows = []
+        cache = client.MCGCache(host, size)
+        loader = ThumbnailLoader(cache, size, self._thumbnail_workers, self._playlist_stop)
+        for album, pixbuf in loader.load(added, True):
+            if pixbuf is None:
+                pixbuf = IconCache.load(Window.STOCK_ICON_DEFAULT, self._item_size)
+            rows.append(self._create_row(album, pixbuf))
+        cache.commit()
+        if not self._playlist_stop.is_set():
+            GObject.idle_add(self._patch_playlist, start, removed, rows, len(previous))
+        self._playlist_lock.release()
+
+
+    def _patch_playlist(self, start, removed, rows, length):
+        if self._playlist_grid.get_model() is None or len(self._playlist_grid_model) != length:
+            self._redraw()
+            return
+        for i in range(removed):
+            self._playlist_grid_model.remove(self._playlist_grid_model.get_iter(start))
+        for i, row in enumerate(rows):
+            self._playlist_grid_model.insert(start + i, row)
+
+
+    def _create_row(self, album, pixbuf):
+        return [
+            pixbuf,
+            GObject.markup_escape_text("\n".join([
+                album.get_title(),
+                album.get_dates_label(),
+                album.get_artists_label()
+            ])),
+            album.get_hash()
+        ]
+
+
     def _redraw(self):
         if self._playlist is not None:
             self.set_playlist(self._host, self._playlist)
@@ -1527,6 +1598,15 @@ class LibraryPanel(GObject.GObject):
         'sort-order-changed': (GObject.SIGNAL_RUN_FIRST, None, (int,)),
         'sort-type-changed': (GObject.SIGNAL_RUN_FIRST, None, (Gtk.SortType,))
     }
+    _PROGRESS_BATCH_SIZE = 25
+    _COVER_BATCH_INTERVAL = 0.2
+    _FILTER_DELAY = 100
+    # Model columns with the sort keys of the sort orders
+    _SORT_COLUMNS = {
+        SortOrder.TITLE: 3,
+        SortOrder.ARTIST: 4,
+        SortOrder.YEAR: 5
+    }
 
 
     def __init__(self, builder):
@@ -1535,14 +1615,20 @@ class LibraryPanel(GObject.GObject):
         self._albums = None
         self._host = "localhost"
         self._filter_string = ""
+        self._search_index = None
+        self._filter_hashes = None
+        self._filter_timer = None
+        self._filter_generation = 0
         self._item_size = 150
+        self._thumbnail_workers = 4
         self._sort_order = SortOrder.YEAR
         self._sort_type = Gtk.SortType.DESCENDING
         self._grid_pixbufs = {}
+        self._grid_iters = {}
         self._old_ranges = {}
         self._library_lock = threading.Lock()
         self._library_stop = threading.Event()
-        self._icon_theme = Gtk.IconTheme.get_default()
+        self._visible_hashes = []
         self._standalone_pixbuf = None
         self._selected_albums = []
         self._allocation = (0, 0)
@@ -1571,6 +1657,8 @@ class LibraryPanel(GObject.GObject):
         self._loading_text = self._progress_label.get_label()
         self._progress_bar = builder.get_object('library-progress')
         self._scroll = builder.get_object('library-scroll')
+        self._scroll.get_vadjustment().connect('value-changed', self.on_scroll_changed)
+        self._scroll.get_vadjustment().connect('changed', self.on_scroll_changed)
         # Toolbar menu
         self._toolbar_search_bar = builder.get_object('library-toolbar-search')
         self._toolbar_popover = builder.get_object('library-toolbar-popover')
@@ -1584,9 +1672,8 @@ class LibraryPanel(GObject.GObject):
         self._grid_scale.set_value(self._item_size)
         self._grid_adjustment = builder.get_object('library-scale-adjustment')
         # Library Grid: Model
-        self._library_grid_model = Gtk.ListStore(GdkPixbuf.Pixbuf, str, str)
-        self._library_grid_model.set_sort_func(2, self.compare_albums, self._sort_order)
-        self._library_grid_model.set_sort_column_id(2, self._sort_type)
+        self._library_grid_model = Gtk.ListStore(GdkPixbuf.Pixbuf, str, str, str, str, str)
+        self._sort()
         self._library_grid_filter = self._library_grid_model.filter_new()
         self._library_grid_filter.set_visible_func(self.on_filter_visible)
         # Library Grid
@@ -1668,6 +1755,10 @@ class LibraryPanel(GObject.GObject):
             )
 
 
+    def on_scroll_changed(self, adjustment):
+        self._update_visible_hashes()
+
+
     def on_search_toggled(self, widget):
         self._filter_bar.set_search_mode(widget.get_active())
 
@@ -1720,7 +1811,7 @@ class LibraryPanel(GObject.GObject):
         else:
             sort_type = Gtk.SortType.ASCENDING
         self._sort_type = sort_type
-        self._library_grid_model.set_sort_column_id(2, sort_type)
+        self._sort()
         self.emit('sort-type-changed', sort_type)
 
 
@@ -1731,7 +1822,9 @@ class LibraryPanel(GObject.GObject):
 
     def on_filter_entry_changed(self, widget):
         self._filter_string = self._filter_entry.get_text()
-        GObject.idle_add(self._library_grid_filter.refilter)
+        if self._filter_timer:
+            GObject.source_remove(self._filter_timer)
+        self._filter_timer = GObject.timeout_add(LibraryPanel._FILTER_DELAY, self._start_filter)
 
 
     def on_library_grid_clicked(self, widget, path):
@@ -1768,8 +1861,7 @@ class LibraryPanel(GObject.GObject):
         hash = model.get_value(iter, 2)
         if not hash in self._albums.keys():
             return
-        album = self._albums[hash]
-        return album.filter(self._filter_string)
+        return self._filter_hashes is None or hash in self._filter_hashes
 
 
     def on_selection_cancel_clicked(self, widget):
@@ -1806,13 +1898,17 @@ class LibraryPanel(GObject.GObject):
         return self._item_size
 
 
+    def set_thumbnail_workers(self, workers):
+        self._thumbnail_workers = workers
+
+
     def set_sort_order(self, sort):
         if self._sort_order != sort:
             button = self._toolbar_sort_buttons[sort]
             if button and not button.get_active():
                 button.set_active(True)
                 self._sort_order = sort
-                self._library_grid_model.set_sort_func(2, self.compare_albums, self._sort_order)
+                self._sort()
 
 
     def get_sort_order(self):
@@ -1829,7 +1925,7 @@ class LibraryPanel(GObject.GObject):
                 self._toolbar_sort_order_button.set_active(False)
             if self._sort_type != sort_type_gtk:
                 self._sort_type = sort_type_gtk
-                self._library_grid_model.set_sort_column_id(2, sort_type)
+                self._sort()
 
 
     def get_sort_type(self):
@@ -1842,13 +1938,11 @@ class LibraryPanel(GObject.GObject):
         threading.Thread(target=self._set_albums, args=(host, albums, self._item_size,)).start()
 
 
-    def compare_albums(self, model, row1, row2, criterion):
-        hash1 = model.get_value(row1, 2)
-        hash2 = model.get_value(row2, 2)
-
-        if hash1 == "" or hash2 == "":
+    def refresh_albums(self, host, albums, added, removed, changed):
+        if self._albums is None or host != self._host:
+            self.set_albums(host, albums)
             return
-        return client.MCGAlbum.compare(self._albums[hash1], self._albums[hash2], criterion)
+        threading.Thread(target=self._refresh_albums, args=(host, albums, added, removed, changed, self._item_size,)).start()
 
 
     def stop_threads(self):
@@ -1857,62 +1951,198 @@ class LibraryPanel(GObject.GObject):
 
     def _change_sort(self, sort):
         self._sort_order = sort
-        self._library_grid_model.set_sort_func(2, self.compare_albums, sort)
+        self._sort()
         self.emit('sort-order-changed', sort)
 
 
+    def _sort(self):
+        self._library_grid_model.set_sort_column_id(LibraryPanel._SORT_COLUMNS[self._sort_order], self._sort_type)
+        GObject.idle_add(self._update_visible_hashes)
+
+
     def _set_albums(self, host, albums, size):
         self._library_lock.acquire()
-        self._library_stop.clear()
+        self._library_stop.set()
+        stop = threading.Event()
+        self._library_stop = stop
+        if albums is not self._albums or self._search_index is None:
+            self._search_index = client.MCGSearchIndex(albums)
         self._albums = albums
+        self._filter_generation += 1
+        self._filter_hashes = self._search_index.search(self._filter_string)
         GObject.idle_add(self._stack.set_visible_child, self._progress_box)
         GObject.idle_add(self._progress_bar.set_fraction, 0.0)
         GObject.idle_add(self._library_grid.set_item_padding, size / 100)
         self._library_grid.set_model(None)
         self._library_grid.freeze_child_notify()
+        self._grid_iters = {}
         self._library_grid_model.clear()
 
+        # Add albums with placeholder images
         i = 0
         n = len(albums)
-        cache = client.MCGCache(host, size)
+        placeholder = self._get_placeholder_image(size)
         self._grid_pixbufs.clear()
-        for hash in albums.keys():
-            album = albums[hash]
-            pixbuf = None
-            try:
-                pixbuf = Utils.load_thumbnail(cache, album, size)
-            except Exception as e:
-                print(e)
-            if pixbuf is None:
-                pixbuf = self._icon_theme.load_icon(
-                    Window.STOCK_ICON_DEFAULT,
-                    self._item_size,
-                    Gtk.IconLookupFlags.FORCE_SVG & Gtk.IconLookupFlags.FORCE_SIZE
-                )
-            if pixbuf is not None:
-                self._grid_pixbufs[album.get_hash()] = pixbuf
-                self._library_grid_model.append([
-                    pixbuf,
-                    GObject.markup_escape_text("\n".join([
-                        album.get_title(),
-                        ', '.join(album.get_dates()),
-                        Utils.create_artists_label(album)
-                    ])),
-                    hash
-                ])
+        for album in albums.values():
+            self._add_album(album, placeholder)
 
             i += 1
-            GObject.idle_add(self._progress_bar.set_fraction, i/n)
-            GObject.idle_add(self._progress_label.set_markup, self._loading_text.format(i, n))
-            if self._library_stop.is_set():
+            if i % LibraryPanel._PROGRESS_BATCH_SIZE == 0 or i == n:
+                GObject.idle_add(self._progress_bar.set_fraction, i/n)
+                GObject.idle_add(self._progress_label.set_markup, self._loading_text.format(i, n))
+            if stop.is_set():
                 self._library_lock.release()
                 return
 
         self._library_grid.set_model(self._library_grid_filter)
         self._library_grid.thaw_child_notify()
         self._library_grid.set_item_width(-1)
+        GObject.idle_add(self._stack.set_visible_child, self._scroll)
+        GObject.idle_add(self._update_visible_hashes)
         self._library_lock.release()
-        self._stack.set_visible_child(self._scroll)
+
+        # Load covers, starting with the visible ones
+        cache = self._load_covers(host, list(albums.keys()), size, stop)
+        if not stop.is_set():
+            cache.retain(self._albums.keys())
+        cache.commit()
+
+
+    def _refresh_albums(self, host, albums, added, removed, changed, size):
+        self._library_lock.acquire()
+        if self._library_stop.is_set():
+            self._library_stop = threading.Event()
+        stop = self._library_stop
+        self._albums = albums
+
+        # Update search index
+        for hash in removed:
+            self._search_index.remove(hash)
+        for hash in added + changed:
+            self._search_index.add(albums[hash])
+        self._filter_generation += 1
+        filter_hashes = self._search_index.search(self._filter_string)
+
+        # Replace rows of removed, added and changed albums
+        placeholder = self._get_placeholder_image(size)
+        rows = [self._create_row(albums[hash], placeholder) for hash in added + changed]
+        GObject.idle_add(self._patch_albums, self._grid_iters, removed + changed, rows, filter_hashes, self._filter_generation)
+        self._library_lock.release()
+
+        # Load covers of added and changed albums
+        cache = self._load_covers(host, added + changed, size, stop)
+        if not stop.is_set():
+            cache.retain(self._albums.keys())
+        cache.commit()
+
+
+    def _start_filter(self):
+        self._filter_timer = None
+        self._filter_generation += 1
+        threading.Thread(target=self._filter, args=(self._filter_string, self._filter_generation,)).start()
+
+
+    def _filter(self, filter_string, generation):
+        """Search the albums matching the filter string and apply the
+        result unless a newer filter has been started in the meantime.
+        """
+        search_index = self._search_index
+        if search_index is None or generation != self._filter_generation:
+            return
+        hashes = search_index.search(filter_string)
+        GObject.idle_add(self._apply_filter, hashes, generation)
+
+
+    def _apply_filter(self, hashes, generation):
+        if generation != self._filter_generation:
+            return
+        self._filter_hashes = hashes
+        self._library_grid_filter.refilter()
+        self._update_visible_hashes()
+
+
+    def _patch_albums(self, grid_iters, hashes, rows, filter_hashes, generation):
+        if grid_iters is not self._grid_iters:
+            return
+        if generation == self._filter_generation:
+            self._filter_hashes = filter_hashes
+        for hash in hashes:
+            if hash in grid_iters:
+                self._library_grid_model.remove(grid_iters.pop(hash))
+            self._grid_pixbufs.pop(hash, None)
+        for row in rows:
+            self._grid_pixbufs[row[2]] = row[0]
+            grid_iters[row[2]] = self._library_grid_model.append(row)
+        self._update_visible_hashes()
+
+
+    def _add_album(self, album, pixbuf):
+        self._grid_pixbufs[album.get_hash()] = pixbuf
+        self._grid_iters[album.get_hash()] = self._library_grid_model.append(self._create_row(album, pixbuf))
+
+
+    def _create_row(self, album, pixbuf):
+        return [
+            pixbuf,
+            GObject.markup_escape_text("\n".join([
+                album.get_title(),
+                album.get_dates_label(),
+                album.get_artists_label()
+            ])),
+            album.get_hash(),
+            album.get_title().casefold(),
+            ', '.join(album.get_artists()).casefold(),
+            album.get_date() or ''
+        ]
+
+
+    def _update_visible_hashes(self):
+        """Remember the hashes of the albums currently visible in the grid
+        so that their covers are loaded first.
+        """
+        hashes = []
+        vis_range = self._library_grid.get_visible_range()
+        if vis_range is not None and self._library_grid.get_model() is not None:
+            (vis_start,), (vis_end,) = vis_range
+            for index in range(vis_start, min(vis_end + 1, len(self._library_grid_filter))):
+                hashes.append(self._library_grid_filter[index][2])
+        self._visible_hashes = hashes
+
+
+    def _get_visible_hashes(self):
+        return self._visible_hashes
+
+
+    def _load_covers(self, host, hashes, size, stop):
+        """Load the covers of the given albums, replace the placeholder
+        images in batches and return the cache used. Covers of visible
+        albums are loaded first.
+        """
+        cache = client.MCGCache(host, size)
+        loader = ThumbnailLoader(cache, size, self._thumbnail_workers, stop)
+        albums = [self._albums[hash] for hash in hashes if hash in self._albums]
+        batch = []
+        batch_time = time.monotonic()
+        for album, pixbuf in loader.load_prioritized(albums, self._get_visible_hashes):
+            if pixbuf is None:
+                continue
+            batch.append((album.get_hash(), pixbuf))
+            if time.monotonic() - batch_time > LibraryPanel._COVER_BATCH_INTERVAL:
+                GObject.idle_add(self._set_covers, self._grid_iters, batch)
+                batch = []
+                batch_time = time.monotonic()
+        if batch and not stop.is_set():
+            GObject.idle_add(self._set_covers, self._grid_iters, batch)
+        return cache
+
+
+    def _set_covers(self, grid_iters, batch):
+        if grid_iters is not self._grid_iters:
+            return
+        for hash, pixbuf in batch:
+            if hash in grid_iters:
+                self._grid_pixbufs[hash] = pixbuf
+                self._library_grid_model.set_value(grid_iters[hash], 0, pixbuf)
 
 
     def _set_widget_grid_size(self, grid_widget, size, vertical):
@@ -1922,7 +2152,8 @@ class LibraryPanel(GObject.GObject):
 
     def _set_widget_grid_size_thread(self, grid_widget, size, vertical):
         self._library_lock.acquire()
-        self._library_stop.clear()
+        if self._library_stop.is_set():
+            self._library_stop = threading.Event()
         grid_filter = grid_widget.get_model()
         grid_model = grid_filter.get_model()
 
@@ -2028,11 +2259,11 @@ class LibraryPanel(GObject.GObject):
 
 
     def _get_default_image(self):
-        return self._icon_theme.load_icon(
-            Window.STOCK_ICON_DEFAULT,
-            64,
-            Gtk.IconLookupFlags.FORCE_SVG & Gtk.IconLookupFlags.FORCE_SIZE
-        )
+        return IconCache.load(Window.STOCK_ICON_DEFAULT, 64)
+
+
+    def _get_placeholder_image(self, size):
+        return IconCache.load(Window.STOCK_ICON_DEFAULT, size)
 
 
 